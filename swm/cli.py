@@ -10,6 +10,7 @@ Usage:
   swm [options] app terminate <query>
   swm [options] app run <query> [no-new-display] [<init_config>]
   swm [options] app list [with-last-used-time] [with-type] [update]
+  swm [options] app timings
   swm [options] app search [with-type] [index]
   swm [options] app most-used [<count>]
   swm [options] app config show-default
@@ -22,6 +23,7 @@ Usage:
   swm [options] ime (switch|activate|deactivate) <query>
   swm [options] ime search
   swm [options] ime switch-to-previous
+  swm [options] ime benchmark [<count>]
   swm [options] java run <script_path>
   swm [options] java shell [<shell_args>...]
   swm [options] termux run <script_path>
@@ -38,11 +40,15 @@ Usage:
   swm [options] device list [last-used]
   swm [options] device search [index]
   swm [options] device select <query>
-  swm [options] device status <query>
+  swm [options] device status [<query>]
   swm [options] device name <device_id> <device_alias>
   swm [options] baseconfig show [diagnostic]
   swm [options] baseconfig show-default
   swm [options] baseconfig edit
+  swm [options] daemon (start|stop|status|serve)
+  swm [options] window list
+  swm [options] window (stop|restart) <query>
+  swm [options] logs <query> [follow]
   swm --version
   swm --help
 
@@ -53,8 +59,16 @@ Options:
                 Use a config file.
   -v --verbose  Enable verbose logging.
   -d --device=<device_selected>
-                Device name or ID for executing the command.
+                Device name or ID for executing the command. Use "all" to run
+                device status, app list update, session save and ime switch
+                on every online device.
   --debug       Debug mode, capturing all exceptions.
+  --trace=<trace_file>
+                Record adb and scrcpy calls, write them as Chrome trace-event JSON
+                and print a per-command latency summary at exit.
+  --timings     Print the phases of "app run" once the app shows up. Every
+                launch is also written to the launch log. Runs the app in
+                this process even if swmd is running.
 
 Environment variables:
   SWM_CACHE_DIR
@@ -70,8 +84,6 @@ MAIN_DISPLAY = -1
 
 # TODO: configure behavior after "unknown" or "manual" scrcpy shutdown, would we remove the background app after close or we keep it open
 
-# TODO: add timeout on all subprocess commands, except for those interactive or indefinite ones
-
 # TODO: check gboard version, include gboard apk in our binary release, install gboard as our official companion input method app in uhid mode
 
 # TODO: blacklist commands, change execution preferences, configs, commandline help based on healthcheck result per device
@@ -134,7 +146,6 @@ MAIN_DISPLAY = -1
 
 # TODO: ask the user to "run anyway" when multiple instances of the same app are running
 
-# TODO: dynamically change the fps of scrcpy, only let the foreground one be full and others be 1 fps
 
 # TODO: use platform specific window session manager
 
@@ -146,6 +157,7 @@ MAIN_DISPLAY = -1
 
 # TODO: show partial help instead of full help based on the command args given
 
+import abc
 import os
 import platform
 import subprocess
@@ -162,6 +174,9 @@ __version__ = "0.1.0"
 
 NO_DEVICE_ID = "NO_DEVICE_ID"
 
+# "--device all" runs supported commands on every online device
+ALL_DEVICES = "all"
+
 
 def check_is_rosetta() -> bool:
     import sys
@@ -255,6 +270,39 @@ def wait_for_all_threads(threads: list):
         t.join()
 
 
+def run_task_graph(tasks: Dict[str, Any], max_workers: int = 4) -> Dict[str, Any]:
+    """tasks maps a name to (dependencies, func), func gets the results of its dependencies as keyword arguments."""
+    import concurrent.futures
+
+    results: Dict[str, Any] = {}
+    pending = dict(tasks)
+    running: Dict[Any, str] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, (dependencies, func) in list(pending.items()):
+                if all(it in results for it in dependencies):
+                    kwargs = {it: results[it] for it in dependencies}
+                    running[executor.submit(func, **kwargs)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError("Unresolvable task dependencies: %s" % list(pending))
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                name = running.pop(future)
+                # the first failure wins, tasks already running are left to finish
+                results[name] = future.result()
+    return results
+
+
+def sanitize_file_name(name: str):
+    # network serials like 192.168.1.5:5555 have characters windows does not allow in file names
+    import re
+
+    return re.sub(r"[^\w.-]", "_", name)
+
+
 def format_keyvalue(data: dict):
     ret = []
     for k, v in data.items():
@@ -264,29 +312,473 @@ def format_keyvalue(data: dict):
     return ret
 
 
+def summarize_durations_ms(durations: List[float]) -> Dict[str, Any]:
+    # durations in seconds
+    durations = sorted(it * 1000 for it in durations)
+    if not durations:
+        return {"count": 0}
+    return {
+        "count": len(durations),
+        "mean_ms": round(sum(durations) / len(durations), 1),
+        "p50_ms": round(durations[int(0.5 * (len(durations) - 1))], 1),
+        "p95_ms": round(durations[int(0.95 * (len(durations) - 1))], 1),
+        "max_ms": round(durations[-1], 1),
+    }
+
+
 def get_first_laddr_port_with_pid(pid: int):
     # used for finding scrcpy local control port
+    # only the sockets of this pid, psutil.net_connections() walks every socket of the host
     import psutil
 
-    conns = psutil.net_connections()
-    conns = [it for it in conns if it.pid == pid]
+    try:
+        process = psutil.Process(pid)
+        # renamed in psutil 6
+        list_connections = getattr(process, "net_connections", None) or process.connections
+        conns = list_connections(kind="inet")
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
     if len(conns) > 0:
         laddr = conns[0].laddr
         ret = getattr(laddr, "port", None)
         return ret
 
 
+class ControlPortRegistry:
+    # scrcpy control ports by pid, shared by all windows, lookups back off until the port shows up
+    def __init__(self, initial_delay: float = 0.25, max_delay: float = 4):
+        import threading
+
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.ports: Dict[int, int] = {}
+        self.next_lookup: Dict[int, Any] = {}  # pid -> (monotonic time, delay)
+        self.lock = threading.Lock()
+
+    def get(self, pid: int) -> Optional[int]:
+        with self.lock:
+            return self.ports.get(pid)
+
+    def lookup(self, pid: int) -> Optional[int]:
+        """Returns the port of pid, discovers it if the backoff allows."""
+        import time
+
+        with self.lock:
+            if pid in self.ports:
+                return self.ports[pid]
+            now = time.monotonic()
+            due_at, delay = self.next_lookup.get(pid, (0, self.initial_delay))
+            if now < due_at:
+                return None
+            self.next_lookup[pid] = (now + delay, min(delay * 2, self.max_delay))
+        port = get_first_laddr_port_with_pid(pid)
+        if port:
+            with self.lock:
+                self.ports[pid] = port
+                self.next_lookup.pop(pid, None)
+        return port
+
+    def forget(self, pid: int):
+        with self.lock:
+            self.ports.pop(pid, None)
+            self.next_lookup.pop(pid, None)
+
+
+class ScrcpyProcessRegistry:
+    # scrcpy windows of every swm process, sqlite in wal mode so concurrent swm processes never see a half written record
+    def __init__(self, db_path: str, legacy_dir: Optional[str] = None):
+        import threading
+
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = self.connect()
+        if legacy_dir and os.path.isdir(legacy_dir):
+            self.import_legacy_pid_files(legacy_dir)
+
+    def connect(self):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(
+            self.db_path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS windows (
+                record_id TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                create_time REAL,
+                device_id TEXT NOT NULL,
+                app_id TEXT NOT NULL,
+                launch_params TEXT NOT NULL,
+                terminate_reason TEXT
+            )"""
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS windows_device_app ON windows (device_id, app_id)"
+        )
+        return conn
+
+    def import_legacy_pid_files(self, legacy_dir: str):
+        """Moves the json pid files of older swm versions into the registry."""
+        import json
+
+        for it in os.listdir(legacy_dir):
+            path = os.path.join(legacy_dir, it)
+            if not it.endswith(".json") or not os.path.isfile(path):
+                continue
+            # claimed by renaming, an swm process starting at the same time gets an error and skips it
+            claimed_path = "%s.%s.importing" % (path, os.getpid())
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                continue
+            try:
+                with open(claimed_path, "r") as f:
+                    data = json.load(f)
+                if not data.get("terminate_reason"):
+                    self.register(
+                        int(data["pid"]), data["device_id"], data["launch_params"]
+                    )
+                os.remove(claimed_path)
+            except Exception as e:
+                print("Warning: Cannot import legacy pid file %s: %s" % (path, e))
+
+    @staticmethod
+    def get_create_time(pid: int) -> Optional[float]:
+        import psutil
+
+        try:
+            return psutil.Process(pid).create_time()
+        except psutil.Error:
+            return None
+
+    def is_alive(self, record: Dict[str, Any]) -> bool:
+        # a reused pid has another start time
+        create_time = self.get_create_time(record["pid"])
+        if create_time is None:
+            return False
+        if record["create_time"] is None:
+            return True
+        return abs(create_time - record["create_time"]) < 0.01
+
+    def register(self, pid: int, device_id: str, launch_params: Dict[str, Any]) -> str:
+        import json
+        import uuid
+
+        record_id = str(uuid.uuid4())
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO windows (record_id, pid, create_time, device_id, app_id, launch_params) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    record_id,
+                    pid,
+                    self.get_create_time(pid),
+                    device_id,
+                    launch_params["package_name"],
+                    json.dumps(launch_params, ensure_ascii=False),
+                ),
+            )
+        return record_id
+
+    def to_record(self, row) -> Dict[str, Any]:
+        import json
+
+        ret = dict(row)
+        ret["launch_params"] = json.loads(ret["launch_params"])
+        return ret
+
+    def get(self, record_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM windows WHERE record_id = ?", (record_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self.to_record(row)
+
+    def list_windows(
+        self, device_id: str, app_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        with self.lock:
+            if app_id is None:
+                rows = self.conn.execute(
+                    "SELECT * FROM windows WHERE device_id = ?", (device_id,)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT * FROM windows WHERE device_id = ? AND app_id = ?",
+                    (device_id, app_id),
+                ).fetchall()
+        return [self.to_record(it) for it in rows]
+
+    def set_terminate_reason(self, record_id: str, reason: str):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE windows SET terminate_reason = ? WHERE record_id = ?",
+                (reason, record_id),
+            )
+
+    def remove(self, record_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM windows WHERE record_id = ?", (record_id,))
+
+
+class ScrcpyWindowLog:
+    # recent lines in memory, every line that passes the repeat filter in a rotating file
+    def __init__(
+        self,
+        path: str,
+        ring_size: int,
+        max_bytes: int,
+        backup_count: int,
+        repeat_interval: float,
+    ):
+        import collections
+        import logging
+        import logging.handlers
+
+        self.path = path
+        self.ring = collections.deque(maxlen=ring_size)
+        self.repeat_interval = repeat_interval
+        self.handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        self.handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        self.last_key = None
+        self.last_emitted_at = 0.0
+        self.repeated = 0
+
+    @staticmethod
+    def repeat_key(stream: str, line: str):
+        # --print-fps lines only differ by their numbers
+        import re
+
+        return stream, re.sub(r"\d+", "#", line)
+
+    def write(self, stream: str, line: str) -> List[str]:
+        """Returns the lines to show, repeats within repeat_interval are folded into a count."""
+        import logging
+        import time
+
+        now = time.monotonic()
+        text = "<scrcpy %s> %s" % (stream, line)
+        self.ring.append(text)
+        key = self.repeat_key(stream, line)
+        if key == self.last_key and now - self.last_emitted_at < self.repeat_interval:
+            self.repeated += 1
+            return []
+        ret = []
+        if self.repeated:
+            ret.append("<scrcpy> last line repeated %s more times" % self.repeated)
+        ret.append(text)
+        self.last_key = key
+        self.last_emitted_at = now
+        self.repeated = 0
+        for it in ret:
+            self.handler.emit(logging.makeLogRecord(dict(msg=it)))
+        return ret
+
+    def tail(self, count: int) -> List[str]:
+        return list(self.ring)[-count:]
+
+    def close(self):
+        import logging
+
+        if self.repeated:
+            message = "<scrcpy> last line repeated %s more times" % self.repeated
+            self.handler.emit(logging.makeLogRecord(dict(msg=message)))
+        self.handler.close()
+
+
+class ScrcpyLogPipeline:
+    # reader threads only enqueue, one writer thread does the file and terminal i/o
+    def __init__(
+        self,
+        log_dir: str,
+        echo=True,
+        ring_size=500,
+        max_bytes=1024 * 1024,
+        backup_count=3,
+        queue_size=10000,
+        repeat_interval=5,
+        keep_windows=50,
+    ):
+        import queue
+        import threading
+
+        self.log_dir = log_dir
+        self.keep_windows = keep_windows
+        self.echo = echo
+        self.ring_size = ring_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.repeat_interval = repeat_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.windows: Dict[int, ScrcpyWindowLog] = {}
+        self.pending_close = set()  # windows closed while the queue was full
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def open_window(self, pid: int, device_id: str, app_id: str) -> ScrcpyWindowLog:
+        os.makedirs(self.log_dir, exist_ok=True)
+        # the window opened below makes it keep_windows again
+        prune_scrcpy_logs(self.log_dir, max(self.keep_windows - 1, 0))
+        filename = "%s__%s__%s.log" % (sanitize_file_name(device_id), app_id, pid)
+        window_log = ScrcpyWindowLog(
+            os.path.join(self.log_dir, filename),
+            ring_size=self.ring_size,
+            max_bytes=self.max_bytes,
+            backup_count=self.backup_count,
+            repeat_interval=self.repeat_interval,
+        )
+        with self.lock:
+            self.windows[pid] = window_log
+            if self.thread is None:
+                self.thread = start_daemon_thread(self.run)
+        return window_log
+
+    def put(self, pid: int, stream: str, line: str):
+        """Never blocks, lines are dropped and counted when the writer falls behind."""
+        import queue
+
+        try:
+            self.queue.put_nowait((pid, stream, line))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def close_window(self, pid: int, timeout: float = 5):
+        """Never raises, called on the cleanup path of a window."""
+        import queue
+        import threading
+
+        # after the lines already queued for this window
+        closed = threading.Event()
+        try:
+            self.queue.put((pid, None, closed), timeout=timeout)
+        except queue.Full:
+            # the writer closes it on its next wakeup, later lines of this window are dropped
+            with self.lock:
+                self.pending_close.add(pid)
+            return
+        closed.wait(timeout)
+
+    def close_pending_windows(self):
+        with self.lock:
+            window_logs = [self.windows.pop(it, None) for it in self.pending_close]
+            self.pending_close.clear()
+        for it in window_logs:
+            if it is not None:
+                it.close()
+
+    def run(self):
+        import queue
+
+        while True:
+            try:
+                pid, stream, line = self.queue.get(timeout=1)
+            except queue.Empty:
+                self.close_pending_windows()
+                continue
+            self.close_pending_windows()
+            with self.lock:
+                window_log = self.windows.get(pid)
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                print("Warning: %s scrcpy log lines dropped, the log writer fell behind" % dropped)
+            if window_log is None:
+                if stream is None:
+                    line.set()
+                continue
+            if stream is None:
+                with self.lock:
+                    self.windows.pop(pid, None)
+                window_log.close()
+                line.set()
+                continue
+            try:
+                shown = window_log.write(stream, line)
+            except Exception as e:
+                print("Warning: Cannot write scrcpy log %s: %s" % (window_log.path, e))
+                continue
+            if self.echo:
+                for it in shown:
+                    print(it)
+
+
+def find_scrcpy_log_file(log_dir: str, query: str) -> str:
+    """Newest log whose scrcpy pid or app id matches query, falls back to a substring match."""
+    exact_matches = []
+    substring_matches = []
+    if os.path.isdir(log_dir):
+        for it in os.listdir(log_dir):
+            if not it.endswith(".log"):
+                continue
+            path = os.path.join(log_dir, it)
+            parts = it[: -len(".log")].split("__")
+            if query in parts[1:]:
+                exact_matches.append((os.path.getmtime(path), path))
+            elif query in it:
+                substring_matches.append((os.path.getmtime(path), path))
+    candidates = exact_matches or substring_matches
+    if not candidates:
+        raise FileNotFoundError("No scrcpy log in %s matches '%s'" % (log_dir, query))
+    return max(candidates)[1]
+
+
+def prune_scrcpy_logs(log_dir: str, keep: int):
+    """Removes the logs of all but the newest keep windows, backups included."""
+    import glob
+
+    windows = []
+    for it in glob.glob(os.path.join(log_dir, "*.log")):
+        try:
+            windows.append((os.path.getmtime(it), it))
+        except OSError:
+            continue  # removed by another swm process
+    windows.sort(reverse=True)
+    for _, path in windows[keep:]:
+        for it in [path, *glob.glob(glob.escape(path) + ".*")]:
+            try:
+                os.remove(it)
+            except OSError:
+                pass
+
+
+def tail_scrcpy_log(path: str, count=50, follow=False):
+    import collections
+    import time
+
+    f = open(path, "r", encoding="utf-8", errors="replace")
+    try:
+        for it in collections.deque(f, maxlen=count):
+            print(it, end="")
+        if not follow:
+            return
+        print("Following %s, Ctrl+C to stop" % path)
+        position = f.tell()
+        while True:
+            line = f.readline()
+            if line:
+                print(line, end="", flush=True)
+                position = f.tell()
+                continue
+            time.sleep(0.25)
+            if os.path.exists(path) and os.path.getsize(path) < position:
+                # rotated
+                f.close()
+                f = open(path, "r", encoding="utf-8", errors="replace")
+                position = 0
+    finally:
+        f.close()
+
+
 def parse_dumpsys_active_apps(text: str):
-    ret = {"foreground": [], "focused": []}
-    lines = grep_lines(text, ["ResumedActivity"])
-    # print("Lines:", lines)
-    for it in lines:
-        if it.startswith("ResumedActivity:"):
-            ret["focused"].append(extract_app_id_from_activity_record(it))
-        elif it.startswith("topResumedActivity="):
-            ret["foreground"].append(extract_app_id_from_activity_record(it))
-    # print("Ret:", ret)
-    return ret
+    return feed_lines_to_parser(text.splitlines(), ActiveAppsLineParser())
 
 
 def extract_app_id_from_activity_record(text: str, return_original_on_failure=True):
@@ -318,6 +810,161 @@ def parse_display_focus(lines: list[str]):
     return ret
 
 
+class IncrementalLineParser(abc.ABC):
+    # fed one line at a time, sets done once it has everything it needs so the reader can stop early
+    # device_filter is an optional "grep" pipeline that drops irrelevant lines on the device
+    device_filter: Optional[str] = None
+
+    def __init__(self):
+        self.done = False
+
+    @abc.abstractmethod
+    def feed(self, line: str): ...
+
+    @abc.abstractmethod
+    def result(self): ...
+
+
+class ActiveAppsLineParser(IncrementalLineParser):
+    # dumpsys activity activities
+    device_filter = "grep ResumedActivity"
+
+    def __init__(self):
+        super().__init__()
+        self.ret = {"foreground": [], "focused": []}
+
+    def feed(self, line: str):
+        line = line.strip()
+        if line.startswith("ResumedActivity:"):
+            self.ret["focused"].append(extract_app_id_from_activity_record(line))
+        elif line.startswith("topResumedActivity="):
+            self.ret["foreground"].append(extract_app_id_from_activity_record(line))
+
+    def result(self):
+        return self.ret
+
+
+class DisplayFocusLineParser(IncrementalLineParser):
+    # dumpsys window displays
+    device_filter = "grep -E 'mDisplayId|mFocusedApp'"
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def feed(self, line: str):
+        line = line.strip()
+        if "mDisplayId" in line or "mFocusedApp" in line:
+            self.lines.append(line)
+
+    def result(self):
+        return parse_display_focus(self.lines)
+
+
+class PowerStateLineParser(IncrementalLineParser):
+    # dumpsys power, both suspend blockers are all we need
+    # they come early in the dump, stopping there beats waiting for a block buffered grep
+    device_filter = None
+    keys = ["mHoldingWakeLockSuspendBlocker", "mHoldingDisplaySuspendBlocker"]
+
+    def __init__(self):
+        super().__init__()
+        self.ret = {}
+
+    def feed(self, line: str):
+        line = line.strip()
+        if line.startswith("mHolding") and "=" in line:
+            key, value = line.split("=", 1)
+            self.ret[key.strip()] = value.strip()
+        self.done = all(it in self.ret for it in self.keys)
+
+    def result(self):
+        return self.ret
+
+
+class RecentTasksLineParser(IncrementalLineParser):
+    # dumpsys activity recents
+    device_filter = "grep 'Recent #'"
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def feed(self, line: str):
+        line = line.strip()
+        if "Recent #" in line and "type=standard" in line:
+            self.lines.append(line)
+
+    def result(self):
+        return self.lines
+
+
+def parse_display_and_lock_state(data: dict):
+    if (
+        data.get("mHoldingWakeLockSuspendBlocker") == "false"
+        and data.get("mHoldingDisplaySuspendBlocker") == "false"
+    ):
+        ret = "off_locked"
+    elif (
+        data.get("mHoldingWakeLockSuspendBlocker") == "true"
+        and data.get("mHoldingDisplaySuspendBlocker") == "true"
+    ):
+        ret = "on_unlocked"
+    elif (
+        data.get("mHoldingWakeLockSuspendBlocker") == "true"
+        and data.get("mHoldingDisplaySuspendBlocker") == "false"
+    ):
+        ret = "on_locked"
+    elif (
+        data.get("mHoldingWakeLockSuspendBlocker") == "false"
+        and data.get("mHoldingDisplaySuspendBlocker") == "true"
+    ):
+        ret = "off_unlocked"
+    else:
+        ret = "unknown"
+    return ret
+
+
+def feed_lines_to_parser(lines, parser: IncrementalLineParser):
+    for it in lines:
+        parser.feed(it)
+        if parser.done:
+            break
+    return parser.result()
+
+
+# event log tags worth a monitor pass, and the field holding the app when there is one
+DEVICE_EVENT_LOG_TAGS = {
+    "am_proc_died": ("death", 2),  # [User,PID,Process Name,...]
+    "am_kill": ("death", 2),  # [User,PID,Process Name,OomAdj,Reason]
+    "wm_task_removed": ("death", None),  # [Task ID,Reason]
+    "wm_set_resumed_activity": ("focus", 1),  # [User,Component Name,Reason]
+    "wm_on_resume_called": ("resume", None),  # [Token,Activity Class,Reason]
+    "am_focused_root_task": ("focus", None),
+    "am_focused_stack": ("focus", None),  # before android 12
+}
+
+
+def parse_event_log_line(line: str) -> Optional[Dict[str, Any]]:
+    # logcat -b events -v tag: "I/am_proc_died: [0,12345,com.example,900,17]"
+    line = line.strip()
+    if line[1:2] != "/" or ":" not in line:
+        return None
+    tag, message = line[2:].split(":", 1)
+    tag = tag.strip()
+    if tag not in DEVICE_EVENT_LOG_TAGS:
+        return None
+    kind, app_field = DEVICE_EVENT_LOG_TAGS[tag]
+    event: Dict[str, Any] = {"kind": kind, "tag": tag, "app_id": None}
+    fields = message.strip().strip("[]").split(",")
+    if app_field is not None and app_field < len(fields):
+        name = fields[app_field].strip()
+        # "com.example:remote" is a secondary process, the app itself may live on
+        if ":" not in name:
+            event["app_id"] = name.split("/")[0]
+    return event
+
+
 def split_lines(text: str) -> list[str]:
     ret = []
     for line in text.splitlines():
@@ -503,6 +1150,200 @@ def encode_base64_str(data: str):
     return encoded_str
 
 
+def generate_shell_frame_marker():
+    import uuid
+
+    return "SWM_FRAME_%s" % uuid.uuid4().hex
+
+
+def build_framed_shell_command(cmd: str, marker: str):
+    # run in a subshell so that "exit", "cd" or "set" in cmd cannot affect the persistent shell
+    # stdin is detached, otherwise the command would swallow the following frames
+    # the leading "\n" of each trailer is stripped again by find_framed_*_trailer
+    return (
+        "( %s ) < /dev/null; printf '\\n%s %%d\\n' \"$?\"; printf '\\n%s\\n' >&2\n"
+        % (cmd, marker, marker)
+    )
+
+
+def find_framed_stdout_trailer(stdout: bytes, marker: str):
+    # returns (output, returncode) once the trailer "\n<marker> <returncode>\n" is complete
+    prefix = ("\n%s " % marker).encode()
+    start = stdout.find(prefix)
+    if start < 0:
+        return None
+    end = stdout.find(b"\n", start + len(prefix))
+    if end < 0:
+        return None
+    returncode = int(stdout[start + len(prefix) : end])
+    return stdout[:start], returncode, stdout[end + 1 :]
+
+
+def find_framed_stderr_trailer(stderr: bytes, marker: str):
+    trailer = ("\n%s\n" % marker).encode()
+    start = stderr.find(trailer)
+    if start < 0:
+        return None
+    return stderr[:start], stderr[start + len(trailer) :]
+
+
+def build_shell_batch(
+    commands: List[str], su=False, call_class: Optional[str] = None
+):
+    """Returns (adb args, marker, call class) running commands in one adb shell."""
+    import shlex
+
+    if call_class is None:
+        # a batch is only as retryable as its least retryable command
+        if all(classify_adb_call(["shell", it]) == "query" for it in commands):
+            call_class = "query"
+        else:
+            call_class = "mutation"
+    marker = generate_shell_frame_marker()
+    script = "".join(build_framed_shell_command(it, marker) for it in commands)
+    if su:
+        args = ["shell", "su", "-c", shlex.quote(script)]
+    else:
+        args = ["shell", script]
+    return args, marker, call_class
+
+
+def split_shell_batch_output(
+    commands: List[str], result: subprocess.CompletedProcess, marker: str, check=False
+) -> List[subprocess.CompletedProcess]:
+    stdout, stderr = result.stdout, result.stderr
+    ret = []
+    for cmd in commands:
+        stdout_frame = find_framed_stdout_trailer(stdout, marker)
+        stderr_frame = find_framed_stderr_trailer(stderr, marker)
+        if not (stdout_frame and stderr_frame):
+            raise ValueError(
+                "Incomplete batch output at command '%s' (exit code %s): %s"
+                % (cmd, result.returncode, stderr.decode("utf-8", errors="replace"))
+            )
+        cmd_stdout, returncode, stdout = stdout_frame
+        cmd_stderr, stderr = stderr_frame
+        completed = subprocess.CompletedProcess(
+            cmd,
+            returncode,
+            cmd_stdout.decode("utf-8", errors="replace"),
+            cmd_stderr.decode("utf-8", errors="replace"),
+        )
+        if check:
+            completed.check_returncode()
+        ret.append(completed)
+    return ret
+
+
+SUBPROCESS_CALL_CLASSES = ["query", "mutation", "transfer", "interactive"]
+
+# shell commands known to be read-only, safe to retry after a timeout
+ADB_QUERY_SHELL_PREFIXES = [
+    "dumpsys",
+    "getprop",
+    "cat",
+    "ls",
+    "test",
+    "stat",
+    "id",
+    "pm list",
+    "pm path",
+    "settings get",
+    "ime list",
+    "cmd package resolve-activity",
+]
+
+# redirection and sequencing can write or run more than the leading command
+ADB_MUTATING_SHELL_OPERATORS = [">", "|", ";", "&&"]
+
+ADB_QUERY_COMMANDS = ["devices", "get-state", "get-serialno", "version", "features"]
+
+ADB_TRANSFER_COMMANDS = ["push", "pull", "install", "install-multiple", "sync"]
+
+
+def classify_adb_call(args: List[str]):
+    if not args:
+        return "interactive"
+    if args[0] in ADB_TRANSFER_COMMANDS:
+        return "transfer"
+    if args[0] in ADB_QUERY_COMMANDS:
+        return "query"
+    if args[0] in ["shell", "exec-out"]:
+        # bare "adb shell" and "-t" are terminals
+        if len(args) == 1 or args[1].startswith("-"):
+            return "interactive"
+        shell_cmd = " ".join(args[1:]).strip()
+        # callers pass call_class="query" for read-only pipelines
+        if any(it in shell_cmd for it in ADB_MUTATING_SHELL_OPERATORS):
+            return "mutation"
+        for it in ADB_QUERY_SHELL_PREFIXES:
+            if shell_cmd == it or shell_cmd.startswith(it + " "):
+                return "query"
+        return "mutation"
+    if args[0] == "logcat":
+        return "interactive"
+    return "mutation"
+
+
+class SubprocessDeadlines:
+    # per call class deadlines, only queries are retried since they have no side effects
+    def __init__(self, config: omegaconf.DictConfig):
+        import collections
+        import threading
+
+        self.timeouts = {
+            "query": 20,
+            "mutation": 60,
+            "transfer": 600,
+            "interactive": None,
+        }
+        self.timeouts.update(config.get("subprocess_timeouts", None) or {})
+        self.query_retries = config.get("subprocess_query_retries", 2)
+        self.retry_backoff = config.get("subprocess_retry_backoff", 0.5)
+        self.timeout_counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def timeout_for(self, call_class: str) -> Optional[float]:
+        if call_class not in SUBPROCESS_CALL_CLASSES:
+            raise ValueError("Unknown subprocess call class: %s" % call_class)
+        return self.timeouts.get(call_class)
+
+    def retries_for(self, call_class: str) -> int:
+        if call_class == "query":
+            return self.query_retries
+        return 0
+
+    def backoff_delay(self, attempt: int) -> float:
+        import random
+
+        # full jitter, so monitors of many windows do not retry in lockstep
+        return random.uniform(0, self.retry_backoff * (2**attempt))
+
+    def record_timeout(self, call_class: str, cmd, timeout: float):
+        with self.lock:
+            self.timeout_counts[call_class] += 1
+            count = self.timeout_counts[call_class]
+        if not isinstance(cmd, str):
+            cmd = " ".join(cmd)
+        print(
+            "Warning: %s call timed out after %.1fs (%s %s timeouts so far): %s"
+            % (call_class, timeout, count, call_class, cmd)
+        )
+
+    def run_with_retries(self, call_class: str, func):
+        import time
+
+        retries = self.retries_for(call_class)
+        for attempt in range(retries + 1):
+            try:
+                return func()
+            except subprocess.TimeoutExpired as e:
+                self.record_timeout(call_class, e.cmd, e.timeout)
+                if attempt == retries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+
+
 # TODO: use logger
 
 # import structlog
@@ -572,6 +1413,23 @@ class DeviceOfflineError(ValueError):
     ...
 
 
+class ShellSessionClosedError(RuntimeError):
+    ...
+
+
+class ShellCommandLostError(ShellSessionClosedError):
+    # the shell died after the command was written, it may have run already
+    ...
+
+
+class AdbProtocolError(RuntimeError):
+    ...
+
+
+class SwmDaemonError(RuntimeError):
+    ...
+
+
 def prompt_for_option_selection(
     options: List[str], prompt: str = "Select an option: "
 ) -> str:
@@ -594,8 +1452,8 @@ def reverse_text(text):
     return "".join(reversed(text))
 
 
-def spawn_and_detach_process(cmd: List[str]):
-    return subprocess.Popen(cmd, start_new_session=True)
+def spawn_and_detach_process(cmd: List[str], **kwargs):
+    return subprocess.Popen(cmd, start_new_session=True, **kwargs)
 
 
 def parse_scrcpy_app_list_output_single_line(text: str):
@@ -954,7 +1812,11 @@ class SWMOnDeviceDatabase:
 
 
 class SWM:
-    def __init__(self, config: omegaconf.DictConfig):
+    def __init__(
+        self, config: omegaconf.DictConfig, tracer: Optional["AdbCallTracer"] = None
+    ):
+        import threading
+
         self.config = config
         self.cache_dir = config.cache_dir
         swm_icon_path = os.path.join(self.cache_dir, "icon", "icon.png")
@@ -972,7 +1834,13 @@ class SWM:
         self.fzf = self._get_binary("fzf", "pc-binaries")
 
         # Initialize components
-        self.adb_wrapper = AdbWrapper(self.adb, self.config)
+        self.adb_wrapper = AdbWrapper(self.adb, self.config, tracer=tracer)
+        self.async_adb_wrapper = AsyncAdbWrapper(
+            self.adb_wrapper,
+            max_concurrency_per_device=config.get("adb_max_concurrency_per_device", 4),
+        )
+        self._async_loop_thread: Optional[AsyncLoopThread] = None
+        self._async_loop_thread_lock = threading.Lock()
         self.scrcpy_wrapper = ScrcpyWrapper(self.scrcpy, self)
         self.fzf_wrapper = FzfWrapper(self.fzf)
 
@@ -990,6 +1858,24 @@ class SWM:
         self.file_manager = FileManager(self)
         self.java_manager = JavaManager(self)
         self.termux_manager = TermuxManager(self)
+        self.device_monitors: Dict[str, DeviceMonitor] = {}
+        self._device_monitors_lock = threading.Lock()
+        self.control_ports = ControlPortRegistry()
+        scrcpy_log_settings = dict(config.get("scrcpy_log", {}))
+        self.scrcpy_logs = ScrcpyLogPipeline(
+            scrcpy_log_settings.pop("dir", os.path.join(config.cache_dir, "scrcpy_logs")),
+            **scrcpy_log_settings,
+        )
+        self.scrcpy_processes = ScrcpyProcessRegistry(
+            config.get(
+                "scrcpy_registry_path",
+                os.path.join(config.cache_dir, "scrcpy_processes.db"),
+            ),
+            legacy_dir=os.path.join(config.cache_dir, "swm_scrcpy_proc_pid"),
+        )
+        self.device_fan_out = DeviceFanOut(
+            self, max_workers=config.get("device_fan_out_max_workers", 4)
+        )
 
     def healthcheck(
         self,
@@ -1044,10 +1930,52 @@ class SWM:
                 # check root permission
                 device_rooted = ...
 
+    @property
+    def async_loop_thread(self):
+        # created on first use, most commands never run a coroutine
+        with self._async_loop_thread_lock:
+            if self._async_loop_thread is None:
+                self._async_loop_thread = AsyncLoopThread()
+            return self._async_loop_thread
+
+    def get_device_monitor(self, device_id: str) -> "DeviceMonitor":
+        with self._device_monitors_lock:
+            if device_id not in self.device_monitors:
+                governor = None
+                governor_settings = self.config.get("scrcpy_governor", {})
+                if governor_settings.get("enabled", False):
+                    governor = ScrcpyGovernor(governor_settings)
+                self.device_monitors[device_id] = DeviceMonitor(
+                    self,
+                    device_id,
+                    interval=self.config.get("device_monitor_interval", 0.5),
+                    event_stream=self.config.get("device_event_stream", True),
+                    event_interval=self.config.get("device_monitor_event_interval", 30),
+                    max_interval=self.config.get("device_monitor_max_interval", 5),
+                    backoff_factor=self.config.get("device_monitor_backoff", 2),
+                    governor=governor,
+                )
+            return self.device_monitors[device_id]
+
     def repl(self):
         print("Warning: REPL mode is not implemented yet.")
         self.repl_manager.repl()
 
+    @property
+    def launch_log_path(self):
+        return self.config.get(
+            "launch_log_path", os.path.join(self.cache_dir, "launch_log.jsonl")
+        )
+
+    def create_launch_profiler(self, app_id: str, print_on_finish=False):
+        return LaunchProfiler(
+            app_id,
+            self.current_device,
+            self.adb_wrapper.tracer,
+            log_path=self.launch_log_path,
+            print_on_finish=print_on_finish,
+        )
+
     @property
     def local_icon_dir(self):
         assert self.current_device
@@ -1102,12 +2030,13 @@ class SWM:
             self.cache_dir, name, bin_type
         )
 
-    def set_current_device(self, device_id: str):
+    def set_current_device(self, device_id: str, cleanup_pid_files=True):
         self.current_device = device_id
         self.adb_wrapper.set_device(device_id)
         self.scrcpy_wrapper.set_device(device_id)
 
-        self.scrcpy_wrapper.cleanup_scrcpy_proc_pid_files()
+        if cleanup_pid_files:
+            self.scrcpy_wrapper.cleanup_scrcpy_proc_pid_files()
         self.adb_wrapper.stay_awake_while_plugged_in()
 
         # now check for android version
@@ -1306,21 +2235,33 @@ class AppManager:
     def retrieve_app_icon(self, package_id: str, icon_path: str):
         self.swm.adb_wrapper.retrieve_app_icon(package_id, icon_path)
 
-    def build_window_title(self, package_id: str):
+    def build_window_title(
+        self,
+        package_id: str,
+        app_name: Optional[str] = None,
+        device_name: Optional[str] = None,
+    ):
         # TODO: set window title as "<device_name> - <app_name>"
         # --window-title=<title>
-        device_id = self.swm.adb_wrapper.device
-        device_name = self.swm.adb_wrapper.get_device_name(device_id)
+        if device_name is None:
+            device_id = self.swm.adb_wrapper.device
+            device_name = self.swm.adb_wrapper.get_device_name(device_id)
         # TODO: make the window title format configurable
         # app_name = package_id
-        app_name = self.swm.adb_wrapper.get_app_name(package_id)
+        if app_name is None:
+            app_name = self.swm.adb_wrapper.get_app_name(package_id)
         return "%s - %s" % (app_name, device_name)
 
     def check_app_existance(self, app_id):
         return self.swm.adb_wrapper.check_app_existance(app_id)
 
     def check_clipboard_malfunction(self):
-        display_and_lock_state = self.swm.adb_wrapper.get_display_and_lock_state()
+        # a snapshot swept by the monitor or a window moments ago saves the dumpsys round trip
+        snapshot = self.swm.adb_wrapper.state_snapshot.cached()
+        if snapshot is not None:
+            display_and_lock_state = snapshot["display_and_lock_state"]
+        else:
+            display_and_lock_state = self.swm.adb_wrapper.get_display_and_lock_state()
         print("Display and lock state: %s" % display_and_lock_state)
         clipboard_may_malfunction = False
         if "_locked" in display_and_lock_state:
@@ -1348,46 +2289,77 @@ class AppManager:
         app_id: str,
         init_config: Optional[str] = None,
         new_display: bool = True,
+        profiler: Optional["LaunchProfiler"] = None,
     ):
-        import traceback
+        adb_wrapper = self.swm.adb_wrapper
+
+        def read_app_config(apk_path):
+            # TODO: memorize the last scrcpy run args, by default in swm config
+            if not apk_path:
+                # do not write a default config for an app that is not there
+                return None
+            if init_config:
+                return self.get_app_config(init_config)
+            return self.get_or_create_app_config(app_id)
+
+        def install_aapt(apk_path):
+            # name and icon both need aapt on the device, pushed once before either runs
+            if apk_path:
+                return adb_wrapper.install_aapt_binary()
+
+        def retrieve_icon(app_config, apk_path, aapt):
+            if not (apk_path and app_config.get("retrieve_app_icon", False)):
+                return None
+            icon_path = os.path.join(self.swm.local_icon_dir, "%s.png" % app_id)
+            if not os.path.exists(icon_path):
+                self.retrieve_app_icon(app_id, icon_path)
+            return icon_path
 
-        self.check_clipboard_malfunction()
-        if not self.check_app_existance(app_id):
+        def get_app_name(apk_path, aapt):
+            if apk_path:
+                return adb_wrapper._get_app_name(apk_path)
+
+        # independent device round trips run side by side
+        results = run_task_graph(
+            {
+                "clipboard": ([], self.check_clipboard_malfunction),
+                "apk_path": ([], lambda: adb_wrapper.get_app_apk_path(app_id)),
+                "app_config": (["apk_path"], read_app_config),
+                "device_name": ([], lambda: adb_wrapper.get_device_name(adb_wrapper.device)),
+                "aapt": (["apk_path"], install_aapt),
+                "app_name": (["apk_path", "aapt"], get_app_name),
+                "icon_path": (["app_config", "apk_path", "aapt"], retrieve_icon),
+            },
+            max_workers=self.swm.config.get("launch_prepare_workers", 4),
+        )
+        if profiler:
+            profiler.mark("config_load")
+        if not results["apk_path"]:
             raise NoAppError(
                 "Applicaion %s does not exist on device %s"
                 % (app_id, self.swm.current_device)
             )
-        # TODO: memorize the last scrcpy run args, by default in swm config
-        # Get app config
         env = {}
-        if init_config:
-            app_config = self.get_app_config(init_config)
-        else:
-            app_config = self.get_or_create_app_config(app_id)
+        app_config = results["app_config"]
         ime_preference = app_config.get("ime_preference", "adbkeyboard")
         # use_adb_keyboard =app_config.get("use_adb_keyboard", False)
         self.ime_preference = ime_preference
 
-        if app_config.get("retrieve_app_icon", False):
-            icon_path = os.path.join(self.swm.local_icon_dir, "%s.png" % app_id)
-            # try:
-            if not os.path.exists(icon_path):
-                self.retrieve_app_icon(app_id, icon_path)
-            env["SCRCPY_ICON_PATH"] = icon_path
-            
-        win = app_config.get("window", None)
+        if results["icon_path"]:
+            env["SCRCPY_ICON_PATH"] = results["icon_path"]
 
+        win = app_config.get("window", None)
 
         scrcpy_args = app_config.get("scrcpy_args", None)
 
         if scrcpy_args is None:
             scrcpy_args = []
 
-        title = self.build_window_title(app_id)
+        title = self.build_window_title(
+            app_id, app_name=results["app_name"], device_name=results["device_name"]
+        )
 
-        # Write last used time to db
-        self.update_app_last_used_time_to_db(app_id)
-        # Execute scrcpy
+        # Execute scrcpy, the last used time is written once it runs
         self.swm.scrcpy_wrapper.launch_app(
             app_id,
             init_config=init_config,
@@ -1398,6 +2370,8 @@ class AppManager:
             # use_adb_keyboard=use_adb_keyboard,
             ime_preference=ime_preference,
             env=env,
+            on_spawned=[lambda: self.update_app_last_used_time_to_db(app_id)],
+            profiler=profiler,
         )
 
     def update_app_last_used_time_to_db(self, app_id: str):
@@ -1895,20 +2869,18 @@ class SessionManager:
         session_names = []
 
         session_info = []
-        for it in session_yaml_paths:
+        stat_results = self.adb_wrapper.execute_batch(
+            [
+                "stat -c '%%X %%Y %%Z' '%s'" % os.path.join(self.session_dir, it)
+                for it in session_yaml_paths
+            ],
+            check=True,
+        )
+        for it, stat_result in zip(session_yaml_paths, stat_results):
             name = os.path.splitext(it)[0]
             session_names.append(name)
-            yaml_fullpath = os.path.join(self.session_dir, it)
 
-            atime = self.adb_wrapper.check_output_shell(
-                ["stat", "-c", "%X", yaml_fullpath]
-            ).strip()
-            mtime = self.adb_wrapper.check_output_shell(
-                ["stat", "-c", "%Y", yaml_fullpath]
-            ).strip()
-            ctime = self.adb_wrapper.check_output_shell(
-                ["stat", "-c", "%Z", yaml_fullpath]
-            ).strip()
+            atime, mtime, ctime = stat_result.stdout.split()
             atime, mtime, ctime = int(atime), int(mtime), int(ctime)
             atime = datetime.datetime.fromtimestamp(atime)
             mtime = datetime.datetime.fromtimestamp(mtime)
@@ -2102,6 +3074,8 @@ class SessionManager:
             print("Not loading session '%s'" % session_name)
             return
 
+        # one thread per window, not a coroutine: launch_app reads its scrcpy stderr
+        # for the whole lifetime of the window and blocks on it
         threads = []
 
         # Restore each window
@@ -2131,30 +3105,378 @@ class SessionManager:
         return {}
 
 
-class DeviceManager:
-    def __init__(self, swm: SWM):
+class DeviceFanOut:
+    # runs one operation on every online device, each device gets its own SWM and AdbWrapper
+    def __init__(self, swm: SWM, max_workers: int = 4):
         self.swm = swm
-        self.current_device_file = os.path.join(
-            self.swm.config.cache_dir, "current_device.txt"
-        )
+        self.max_workers = max_workers
+
+    def create_device_swm(self, device_id: str):
+        config = omegaconf.OmegaConf.create(
+            omegaconf.OmegaConf.to_container(self.swm.config)
+        )
+        config.device = device_id
+        ret = SWM(config, tracer=self.swm.adb_wrapper.tracer)
+        ret.current_device_name = ret.adb_wrapper.get_device_name(device_id)
+        # pid files are shared by all devices, leave them to single device runs
+        ret.set_current_device(device_id, cleanup_pid_files=False)
+        ret.load_swm_on_device_db()
+        return ret
+
+    def _run_on_device(self, device_id: str, operation):
+        row: Dict[str, Any] = {"device": device_id}
+        try:
+            device_swm = self.create_device_swm(device_id)
+            row["device_name"] = device_swm.current_device_name
+            result = operation(device_swm)
+            if isinstance(result, dict):
+                row.update(result)
+            row["error"] = ""
+        except Exception as e:
+            row["error"] = "%s: %s" % (type(e).__name__, e)
+        return row
+
+    def run(self, operation, print_formatted=True) -> List[Dict[str, Any]]:
+        from concurrent.futures import ThreadPoolExecutor
+
+        device_ids = self.swm.adb_wrapper.list_device_ids()
+        if not device_ids:
+            raise NoDeviceError("No available device")
+        print("Running on %s devices: %s" % (len(device_ids), ", ".join(device_ids)))
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.max_workers, len(device_ids)))
+        ) as executor:
+            ret = list(
+                executor.map(
+                    lambda it: self._run_on_device(it, operation), device_ids
+                )
+            )
+        if print_formatted:
+            load_and_print_as_dataframe(ret, sort_columns=False)
+        return ret
+
+    def status(self):
+        return self.run(lambda it: it.device_manager.status())
+
+    def update_app_list(self):
+        def operation(device_swm: SWM):
+            apps = device_swm.app_manager.list(update_cache=True)
+            return {"apps": len(apps)}
+
+        return self.run(operation)
+
+    def save_session(self, session_name: str):
+        def operation(device_swm: SWM):
+            device_swm.session_manager.save(session_name)
+            return {"session": session_name}
+
+        return self.run(operation)
+
+    def switch_ime(self, ime_id: str):
+        def operation(device_swm: SWM):
+            # no fzf in workers, the ime must match exactly
+            if ime_id not in device_swm.ime_manager.list():
+                raise ValueError("IME %s is not installed" % ime_id)
+            device_swm.ime_manager._switch(ime_id)
+            return {"ime": ime_id}
+
+        return self.run(operation)
+
+
+class SwmDaemonClient:
+    # talks to swmd over its unix socket, one JSON line per request and per response
+    def __init__(self, socket_path: str, timeout: float = 60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    @staticmethod
+    def is_supported():
+        import socket
+
+        # unix domain sockets are missing on windows
+        return hasattr(socket, "AF_UNIX")
+
+    def request(self, op: str, **params):
+        import json
+        import socket
+
+        if not self.is_supported():
+            raise SwmDaemonError("swmd needs unix sockets, which this platform lacks")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            payload = json.dumps(dict(op=op, **params), ensure_ascii=False) + "\n"
+            sock.sendall(payload.encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as f:
+                line = f.readline()
+        if not line:
+            raise SwmDaemonError("swmd closed the connection without a response")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise SwmDaemonError(response["error"])
+        return response["result"]
+
+    def is_running(self):
+        if not self.is_supported():
+            return False
+        try:
+            self.request("ping")
+            return True
+        except (OSError, SwmDaemonError):
+            return False
+
+
+class SwmDaemon:
+    # swmd owns the scrcpy windows of all devices, each device gets one SWM so windows share
+    # its adb connection, persistent shells and device monitor instead of one process per window
+    def __init__(self, swm: SWM, socket_path: str):
+        import threading
+
+        self.swm = swm
+        self.socket_path = socket_path
+        self.device_swms: Dict[str, SWM] = {}
+        self.lock = threading.Lock()
+        # launch requests by "device_id/app_id", a window keeps its record across restarts
+        self.windows: Dict[str, Dict[str, Any]] = {}
+        self.started_at = None
+        self.server = None
+
+    def get_device_swm(self, device_id: str) -> SWM:
+        with self.lock:
+            if device_id not in self.device_swms:
+                self.device_swms[device_id] = self.swm.device_fan_out.create_device_swm(
+                    device_id
+                )
+            return self.device_swms[device_id]
+
+    def run_app(
+        self,
+        device_id: str,
+        app_id: str,
+        init_config: Optional[str] = None,
+        new_display: bool = True,
+    ):
+        record = dict(
+            device_id=device_id,
+            app_id=app_id,
+            init_config=init_config,
+            new_display=new_display,
+        )
+        with self.lock:
+            self.windows["%s/%s" % (device_id, app_id)] = record
+        # launch_policy and the pid files take care of an instance already running
+        record["thread"] = start_daemon_thread(self._run_window, args=(record,))
+        return dict(device_id=device_id, app_id=app_id)
+
+    def _run_window(self, record: Dict[str, Any]):
+        import traceback
+
+        profiler = None
+        try:
+            device_swm = self.get_device_swm(record["device_id"])
+            profiler = device_swm.create_launch_profiler(record["app_id"])
+            device_swm.app_manager.run(
+                record["app_id"],
+                init_config=record["init_config"],
+                new_display=record["new_display"],
+                profiler=profiler,
+            )
+        except Exception:
+            traceback.print_exc()
+            if profiler:
+                # a launch that failed before its window existed still gets its record
+                profiler.finish("failed")
+
+    def iter_procs(self):
+        with self.lock:
+            device_swms = list(self.device_swms.items())
+        for device_id, device_swm in device_swms:
+            for proc in list(device_swm.scrcpy_wrapper.procs.values()):
+                yield device_id, proc
+
+    def list_windows(self) -> List[Dict[str, Any]]:
+        import time
+
+        ret = []
+        for device_id, proc in self.iter_procs():
+            ret.append(
+                dict(
+                    pid=proc.pid,
+                    device_id=device_id,
+                    app_id=getattr(proc, "app_id"),
+                    display_id=getattr(proc, "display_id", None),
+                    control_port=getattr(proc, "control_port", None),
+                    uptime=round(time.time() - getattr(proc, "started_at")),
+                )
+            )
+        return ret
+
+    def find_procs(self, query: str) -> List[Any]:
+        """Matches a scrcpy pid or an app id."""
+        ret = []
+        for device_id, proc in self.iter_procs():
+            if query in [str(proc.pid), getattr(proc, "app_id")]:
+                ret.append((device_id, proc))
+        if not ret:
+            raise SwmDaemonError("No window matches '%s'" % query)
+        return ret
+
+    def stop_window(self, query: str):
+        ret = []
+        for device_id, proc in self.find_procs(query):
+            setattr(proc, "terminate_reason", "user_requested")
+            proc.terminate()
+            ret.append(dict(pid=proc.pid, device_id=device_id, app_id=getattr(proc, "app_id")))
+        return ret
+
+    def restart_window(self, query: str, timeout: float = 30):
+        ret = self.stop_window(query)
+        for it in ret:
+            record = self.windows.get("%s/%s" % (it["device_id"], it["app_id"]))
+            if record is None:
+                continue
+            # the old launch cleans up, reverts the ime and so on before we launch again
+            record["thread"].join(timeout)
+            self.run_app(
+                record["device_id"],
+                record["app_id"],
+                init_config=record["init_config"],
+                new_display=record["new_display"],
+            )
+        return ret
 
     def status(self):
+        import time
+
+        with self.lock:
+            devices = list(self.device_swms.keys())
+        return dict(
+            pid=os.getpid(),
+            uptime=round(time.time() - self.started_at),  # type: ignore
+            socket_path=self.socket_path,
+            devices=devices,
+            windows=len(self.list_windows()),
+        )
+
+    def shutdown(self):
+        for _, proc in self.iter_procs():
+            setattr(proc, "terminate_reason", "user_requested")
+            proc.terminate()
+        # shutdown() waits for serve_forever, which is serving this very request
+        start_daemon_thread(self.server.shutdown)  # type: ignore
+        return dict(pid=os.getpid())
+
+    def handle(self, request: Dict[str, Any]):
+        op = request.pop("op", None)
+        handlers = {
+            "ping": lambda: "pong",
+            "status": self.status,
+            "run": self.run_app,
+            "list": self.list_windows,
+            "stop": self.stop_window,
+            "restart": self.restart_window,
+            "shutdown": self.shutdown,
+        }
+        if op not in handlers:
+            raise SwmDaemonError("Unknown swmd operation '%s'" % op)
+        return handlers[op](**request)
+
+    def serve_forever(self):
+        import json
+        import socketserver
+        import time
+
+        if not SwmDaemonClient.is_supported():
+            raise SwmDaemonError("swmd needs unix sockets, which this platform lacks")
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        result = daemon.handle(json.loads(line))
+                        response = dict(ok=True, result=result)
+                    except Exception as e:
+                        response = dict(ok=False, error="%s: %s" % (type(e).__name__, e))
+                    payload = json.dumps(response, ensure_ascii=False) + "\n"
+                    self.wfile.write(payload.encode("utf-8"))
+
+        if SwmDaemonClient(self.socket_path).is_running():
+            raise SwmDaemonError("swmd is already listening at %s" % self.socket_path)
+        if os.path.exists(self.socket_path):
+            # left behind by a daemon that did not exit cleanly
+            os.remove(self.socket_path)
+        self.started_at = time.time()
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        print("swmd (PID: %s) listening at %s" % (os.getpid(), self.socket_path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        # let the windows finish their cleanup
+        with self.lock:
+            records = list(self.windows.values())
+        for it in records:
+            it["thread"].join(30)
+        print("swmd stopped")
+
+
+class DeviceManager:
+    def __init__(self, swm: SWM):
+        self.swm = swm
+        self.current_device_file = os.path.join(
+            self.swm.config.cache_dir, "current_device.txt"
+        )
+
+    status_commands = [
+        ["dumpsys", "audio"],
+        ["dumpsys", "battery"],
+        ["dumpsys", "wifi"],
+        ["dumpsys", "bluetooth_manager"],
+        ["settings", "get", "global", "airplane_mode_on"],
+        ["settings", "get", "global", "wifi_ap_state"],
+        ["settings", "get", "global", "mobile_data"],
+        ["dumpsys", "location"],
+        ["dumpsys", "nfc"],
+    ]
+
+    def status(self):
+        return self.swm.async_loop_thread.run(self.status_async())
+
+    async def status_async(self):
         # TODO: use svc to toggle status 
-        return {
-            **self._get_audio_status(),
-            **self._get_battery_status(),
-            **self._get_wifi_status(),
-            **self._get_bluetooth_status(),
-            **self._get_airplane_mode_status(),
-            **self._get_hotspot_status(),
-            **self._get_mobile_data_status(),
-            **self._get_location_status(),
-            **self._get_nfc_status(),
-            # **self._get_flashlight_status(),
+        # fetch everything in one round trip, the getters below read from the prefetched output
+        results = await self.swm.async_adb_wrapper.execute_batch(
+            [" ".join(it) for it in self.status_commands]
+        )
+        self.prefetched_command_results = {
+            " ".join(cmd): result for cmd, result in zip(self.status_commands, results)
         }
+        try:
+            return {
+                **self._get_audio_status(),
+                **self._get_battery_status(),
+                **self._get_wifi_status(),
+                **self._get_bluetooth_status(),
+                **self._get_airplane_mode_status(),
+                **self._get_hotspot_status(),
+                **self._get_mobile_data_status(),
+                **self._get_location_status(),
+                **self._get_nfc_status(),
+                # **self._get_flashlight_status(),
+            }
+        finally:
+            self.prefetched_command_results = {}
 
     def _run_command(self, cmd):
         """Helper to execute shell commands."""
+        result = getattr(self, "prefetched_command_results", {}).get(" ".join(cmd))
+        if result is not None:
+            result.check_returncode()
+            return result.stdout.strip()
         return self.swm.adb_wrapper.check_output_shell(cmd)
 
     def _get_audio_status(self): # not working well
@@ -2384,20 +3706,868 @@ class DeviceManager:
         self.swm.adb_wrapper.set_device_name(device_id, alias)
 
 
+class SingleFlight:
+    # concurrent calls with the same key share one execution and its result or exception, nothing is kept afterwards
+    def __init__(self):
+        import threading
+
+        self.lock = threading.Lock()
+        self.inflight: Dict[Any, Dict[str, Any]] = {}
+        self.shared_calls = 0
+
+    def do(self, key, func):
+        import threading
+
+        with self.lock:
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.inflight[key] = call
+            else:
+                self.shared_calls += 1
+        assert call is not None
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = func()
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            call["done"].set()
+
+    def record_shared_call(self):
+        # for callers that share an execution outside of do(), e.g. asyncio tasks
+        with self.lock:
+            self.shared_calls += 1
+
+
+# wrappers between a caller and the subprocess, skipped when looking for the caller
+ADB_CALL_PLUMBING_FUNCTIONS = [
+    "execute",
+    "_execute_once",
+    "check_output",
+    "check_output_shell",
+    "check_output_su",
+    "execute_shell",
+    "execute_su_cmd",
+    "execute_batch",
+    "stream_shell_lines",
+    "_stream_shell_lines_once",
+    "run_with_retries",
+    "_execute_with_deadline",
+    "do",
+    "trace",
+    "<lambda>",
+]
+
+
+class AdbCallTracer:
+    # counts every adb/scrcpy call, and keeps the calls for a trace file when record_events is set
+    def __init__(self, record_events=False):
+        import collections
+        import threading
+        import time
+
+        self.record_events = record_events
+        self.events: List[Dict[str, Any]] = []
+        self.call_counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    @property
+    def call_count(self):
+        return sum(self.call_counts.values())
+
+    def find_caller(self):
+        import sys
+
+        # skip ourselves and start()
+        frame = sys._getframe(2)
+        while frame is not None:
+            code = frame.f_code
+            if not (
+                code.co_filename == __file__
+                and code.co_name in ADB_CALL_PLUMBING_FUNCTIONS
+            ):
+                name = getattr(code, "co_qualname", code.co_name)
+                return "%s:%s" % (name, frame.f_lineno)
+            frame = frame.f_back
+        return "unknown"
+
+    def start(self, program: str, cmd: List[str], call_class: str):
+        import threading
+        import time
+
+        with self.lock:
+            self.call_counts[program] += 1
+        if not self.record_events:
+            return None
+        return dict(
+            program=program,
+            cmd=cmd,
+            call_class=call_class,
+            caller=self.find_caller(),
+            tid=threading.get_ident(),
+            start=time.perf_counter(),
+        )
+
+    def finish(
+        self,
+        token,
+        result=None,
+        error: Optional[BaseException] = None,
+        bytes_out: Optional[int] = None,
+    ):
+        import time
+
+        if token is None:
+            return
+        token["duration"] = time.perf_counter() - token["start"]
+        if isinstance(error, subprocess.CalledProcessError):
+            result = error
+        token["returncode"] = getattr(result, "returncode", None)
+        if bytes_out is None:
+            bytes_out = sum(
+                len(it.encode("utf-8") if isinstance(it, str) else it)
+                for it in [
+                    getattr(result, "stdout", None),
+                    getattr(result, "stderr", None),
+                ]
+                if it
+            )
+        token["bytes_out"] = bytes_out
+        token["timed_out"] = isinstance(error, subprocess.TimeoutExpired)
+        token["error"] = None if error is None else type(error).__name__
+        with self.lock:
+            self.events.append(token)
+
+    def trace(self, program: str, cmd: List[str], call_class: str, func):
+        token = self.start(program, cmd, call_class)
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(token, error=e)
+            raise
+        self.finish(token, result=result)
+        return result
+
+    def summary_key(self, event: Dict[str, Any]):
+        # "adb shell dumpsys", without the serial and the arguments
+        cmd = list(event["cmd"][1:])
+        if len(cmd) >= 2 and cmd[0] == "-s":
+            cmd = cmd[2:]
+        words = " ".join(cmd).split()
+        if words and words[0] == "shell":
+            words = words[:2]
+            if len(words) == 2 and words[1].startswith("("):
+                # framed commands from execute_batch
+                words[1] = "<batch>"
+        else:
+            words = words[:1]
+        return " ".join([event["program"], *words])
+
+    def summarize(self):
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for it in self.events:
+            groups.setdefault(self.summary_key(it), []).append(it)
+        ret = []
+        for key, events in groups.items():
+            durations = sorted(it["duration"] * 1000 for it in events)
+            ret.append(
+                {
+                    "command": key,
+                    "calls": len(events),
+                    "total_ms": round(sum(durations), 1),
+                    "mean_ms": round(sum(durations) / len(durations), 1),
+                    "p95_ms": round(durations[int(0.95 * (len(durations) - 1))], 1),
+                    "max_ms": round(durations[-1], 1),
+                    "bytes_out": sum(it["bytes_out"] for it in events),
+                    "failures": sum(
+                        1 for it in events if it["error"] or it["returncode"]
+                    ),
+                    "timeouts": sum(1 for it in events if it["timed_out"]),
+                }
+            )
+        ret.sort(key=lambda it: it["total_ms"], reverse=True)
+        return ret
+
+    def to_chrome_trace(self):
+        ret = []
+        pid = os.getpid()
+        for it in self.events:
+            ret.append(
+                {
+                    "name": " ".join(it["cmd"][1:])[:200],
+                    "cat": "%s,%s" % (it["program"], it["call_class"]),
+                    "ph": "X",
+                    "ts": round((it["start"] - self.origin) * 1e6),
+                    "dur": round(it["duration"] * 1e6),
+                    "pid": pid,
+                    "tid": it["tid"],
+                    "args": {
+                        "caller": it["caller"],
+                        "returncode": it["returncode"],
+                        "bytes_out": it["bytes_out"],
+                        "timed_out": it["timed_out"],
+                        "error": it["error"],
+                    },
+                }
+            )
+        return {"traceEvents": ret, "displayTimeUnit": "ms"}
+
+    def save(self, trace_file: str):
+        import json
+
+        with self.lock:
+            data = self.to_chrome_trace()
+        with open(trace_file, "w") as f:
+            json.dump(data, f, ensure_ascii=False)
+        print("Trace of %s calls written to %s" % (len(data["traceEvents"]), trace_file))
+
+    def save_and_print_summary(self, trace_file: str):
+        self.save(trace_file)
+        with self.lock:
+            summary = self.summarize()
+        load_and_print_as_dataframe(
+            summary,
+            sort_columns=False,
+        )
+
+
+class LaunchProfiler:
+    # wall time and adb calls per launch phase, each phase ends at a milestone of the launch
+    # adb calls are counted over all threads, overlapping launches share them
+    def __init__(
+        self,
+        app_id: str,
+        device_id: Optional[str],
+        tracer: AdbCallTracer,
+        log_path: Optional[str] = None,
+        print_on_finish=False,
+    ):
+        import threading
+        import time
+
+        self.app_id = app_id
+        self.device_id = device_id
+        self.tracer = tracer
+        self.log_path = log_path
+        self.print_on_finish = print_on_finish
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.last_mark = time.perf_counter()
+        self.started_perf = self.last_mark
+        self.last_call_count = tracer.call_count
+        self.phases: List[Dict[str, Any]] = []
+        self.finished = False
+
+    def mark(self, phase: str):
+        """Ends the phase named after the milestone just reached, only the first mark of a phase counts."""
+        import time
+
+        with self.lock:
+            if self.finished or any(it["phase"] == phase for it in self.phases):
+                return
+            now = time.perf_counter()
+            call_count = self.tracer.call_count
+            self.phases.append(
+                dict(
+                    phase=phase,
+                    ms=round((now - self.last_mark) * 1000, 1),
+                    adb_calls=call_count - self.last_call_count,
+                )
+            )
+            self.last_mark = now
+            self.last_call_count = call_count
+
+    def finish(self, status: str = "app_in_display"):
+        import json
+        import time
+
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            record = dict(
+                app_id=self.app_id,
+                device_id=self.device_id,
+                started_at=self.started_at,
+                status=status,
+                total_ms=round((time.perf_counter() - self.started_perf) * 1000, 1),
+                phases=self.phases,
+            )
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if self.print_on_finish:
+            print("Launch timings of %s (%s):" % (self.app_id, status))
+            load_and_print_as_dataframe(self.phases, sort_columns=False)
+            print("Total: %s ms" % record["total_ms"])
+        return record
+
+
+def summarize_launch_log(log_path: str) -> List[Dict[str, Any]]:
+    import json
+
+    if not os.path.exists(log_path):
+        return []
+    launches: Dict[str, List[Dict[str, Any]]] = {}
+    with open(log_path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                launches.setdefault(record["app_id"], []).append(record)
+    ret = []
+    for app_id, records in launches.items():
+        complete = [it for it in records if it["status"] == "app_in_display"]
+        row: Dict[str, Any] = dict(app_id=app_id, launches=len(records), complete=len(complete))
+        total = summarize_durations_ms([it["total_ms"] / 1000 for it in complete])
+        row["p50_ms"] = total.get("p50_ms")
+        row["p95_ms"] = total.get("p95_ms")
+        # median of every phase, to see where the time goes
+        phase_names = []
+        for it in complete:
+            for phase in it["phases"]:
+                if phase["phase"] not in phase_names:
+                    phase_names.append(phase["phase"])
+        for name in phase_names:
+            durations = [
+                phase["ms"] / 1000
+                for it in complete
+                for phase in it["phases"]
+                if phase["phase"] == name
+            ]
+            row["%s_p50_ms" % name] = summarize_durations_ms(durations).get("p50_ms")
+        ret.append(row)
+    ret.sort(key=lambda it: it["launches"], reverse=True)
+    return ret
+
+
+class PersistentAdbShell:
+    # one long-lived "adb shell" per device, commands are framed with a random marker carrying the exit code
+    def __init__(
+        self, adb_path: str, device_id: str, login_args: Optional[List[str]] = None
+    ):
+        import threading
+
+        self.adb_path = adb_path
+        self.device_id = device_id
+        self.login_args = login_args or []
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.proc: Optional[subprocess.Popen] = None
+        self.stdout_buffer = bytearray()
+        self.stderr_buffer = bytearray()
+        self.completed_runs = 0
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        cmd = [self.adb_path, "-s", self.device_id, "shell", "-T", *self.login_args]
+        self.stdout_buffer = bytearray()
+        self.stderr_buffer = bytearray()
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        start_daemon_thread(self._reader, args=(self.proc.stdout, self.stdout_buffer))
+        start_daemon_thread(self._reader, args=(self.proc.stderr, self.stderr_buffer))
+
+    def _reader(self, stream, buffer: bytearray):
+        while True:
+            chunk = stream.read(65536)
+            with self.condition:
+                if chunk:
+                    buffer.extend(chunk)
+                self.condition.notify_all()
+            if not chunk:
+                break
+
+    def close(self):
+        proc = self.proc
+        self.proc = None
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait()
+            except:
+                pass
+        with self.condition:
+            self.condition.notify_all()
+
+    def run(self, cmd: str, timeout: Optional[float] = None):
+        """Run a command in the persistent shell, returns (returncode, stdout, stderr) in bytes."""
+        with self.lock:
+            if not self.alive:
+                self.start()
+                # a shell that cannot start (offline device, su denied) fails here,
+                # before the command is sent, so callers can safely run it elsewhere
+                try:
+                    self._run_locked("true", timeout)
+                except ShellCommandLostError as e:
+                    raise ShellSessionClosedError(e.args[0])
+            return self._run_locked(cmd, timeout)
+
+    def _run_locked(self, cmd: str, timeout: Optional[float] = None):
+        import time
+
+        proc = self.proc
+        assert proc and proc.stdin
+        marker = generate_shell_frame_marker()
+        try:
+            proc.stdin.write(build_framed_shell_command(cmd, marker).encode("utf-8"))
+            proc.stdin.flush()
+        except OSError as e:
+            self.close()
+            raise ShellSessionClosedError("Failed to write to adb shell: %s" % e)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                stdout_frame = find_framed_stdout_trailer(bytes(self.stdout_buffer), marker)
+                stderr_frame = find_framed_stderr_trailer(bytes(self.stderr_buffer), marker)
+                if stdout_frame and stderr_frame:
+                    stdout, returncode, stdout_rest = stdout_frame
+                    stderr, stderr_rest = stderr_frame
+                    self.stdout_buffer[:] = stdout_rest
+                    self.stderr_buffer[:] = stderr_rest
+                    self.completed_runs += 1
+                    return returncode, stdout, stderr
+                if proc.poll() is not None:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(timeout=remaining if remaining is not None else 1)
+        if proc.poll() is not None:
+            self.close()
+            raise ShellCommandLostError(
+                "adb shell for device %s exited with code %s"
+                % (self.device_id, proc.returncode)
+            )
+        # the stream is out of sync after a timeout, start over next time
+        self.close()
+        raise subprocess.TimeoutExpired(cmd, timeout)  # type: ignore
+
+
+class AdbSocketClient:
+    # talks to the local adb server directly, see SERVICES.TXT and protocol.txt in the adb source tree
+    SHELL_ID_STDOUT = 1
+    SHELL_ID_STDERR = 2
+    SHELL_ID_EXIT = 3
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 5037, connect_timeout: float = 10
+    ):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.device_features: Dict[str, List[str]] = {}
+
+    def connect(self, timeout: Optional[float] = None):
+        # timeout applies to reads after connecting, None blocks like a subprocess would
+        import socket
+
+        sock = socket.create_connection(
+            (self.host, self.port), timeout=self.connect_timeout
+        )
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(timeout)
+        return sock
+
+    def read_exact(self, sock, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise AdbProtocolError(
+                    "Connection closed by adb server (%s/%s bytes read)"
+                    % (len(data), size)
+                )
+            data.extend(chunk)
+        return bytes(data)
+
+    def read_hex_length_prefixed(self, sock) -> bytes:
+        length = int(self.read_exact(sock, 4), 16)
+        return self.read_exact(sock, length)
+
+    def send_request(self, sock, request: str):
+        payload = request.encode("utf-8")
+        sock.sendall(b"%04x" % len(payload) + payload)
+        status = self.read_exact(sock, 4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = self.read_hex_length_prefixed(sock)
+            raise AdbProtocolError(
+                "adb server refused '%s': %s"
+                % (request, message.decode("utf-8", errors="replace"))
+            )
+        raise AdbProtocolError(
+            "Unexpected adb server status %r for '%s'" % (status, request)
+        )
+
+    def query(self, request: str) -> str:
+        with self.connect(timeout=self.connect_timeout) as sock:
+            self.send_request(sock, request)
+            return self.read_hex_length_prefixed(sock).decode("utf-8", errors="replace")
+
+    def devices(self) -> List[Dict[str, str]]:
+        ret = []
+        for line in split_lines(self.query("host:devices")):
+            serial, state = line.split("\t", 1)
+            ret.append({"id": serial, "status": state})
+        return ret
+
+    def get_device_features(self, serial: str) -> List[str]:
+        if serial not in self.device_features:
+            output = self.query("host-serial:%s:features" % serial)
+            self.device_features[serial] = output.strip().split(",")
+        return self.device_features[serial]
+
+    def open_transport(self, serial: str, timeout: Optional[float] = None):
+        sock = self.connect(timeout=timeout)
+        try:
+            self.send_request(sock, "host:transport:%s" % serial)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def shell(self, serial: str, cmd: str, timeout: Optional[float] = None):
+        """Run a shell command on the device, returns (returncode, stdout, stderr) in bytes."""
+        import struct
+
+        if "shell_v2" not in self.get_device_features(serial):
+            # legacy shell merges stderr into stdout and has no exit code, the command prints it after a marker
+            marker = generate_shell_frame_marker()
+            framed_cmd = "( %s ) < /dev/null; printf '\\n%s %%d\\n' \"$?\"" % (cmd, marker)
+            with self.open_transport(serial, timeout=timeout) as sock:
+                self.send_request(sock, "shell:%s" % framed_cmd)
+                stdout = bytearray()
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    stdout.extend(chunk)
+            # the legacy shell may run through a pty that turns "\n" into "\r\n"
+            stdout_frame = find_framed_stdout_trailer(
+                bytes(stdout).replace(b"\r\n", b"\n"), marker
+            )
+            if stdout_frame is None:
+                raise ShellSessionClosedError(
+                    "Shell session for device %s closed without exit code" % serial
+                )
+            returncode, output = stdout_frame[1], stdout_frame[0]
+            return returncode, output, b""
+
+        stdout = bytearray()
+        stderr = bytearray()
+        returncode = None
+        with self.open_transport(serial, timeout=timeout) as sock:
+            self.send_request(sock, "shell,v2,raw:%s" % cmd)
+            while True:
+                try:
+                    header = self.read_exact(sock, 5)
+                except AdbProtocolError:
+                    break
+                packet_id, length = struct.unpack("<BI", header)
+                data = self.read_exact(sock, length)
+                if packet_id == self.SHELL_ID_STDOUT:
+                    stdout.extend(data)
+                elif packet_id == self.SHELL_ID_STDERR:
+                    stderr.extend(data)
+                elif packet_id == self.SHELL_ID_EXIT:
+                    returncode = data[0]
+                    break
+        if returncode is None:
+            # the command may have run already, do not let the caller retry it elsewhere
+            raise ShellSessionClosedError(
+                "Shell session for device %s closed without exit code" % serial
+            )
+        return returncode, bytes(stdout), bytes(stderr)
+
+    def open_sync(self, serial: str, timeout: Optional[float] = None):
+        sock = self.open_transport(serial, timeout=timeout)
+        try:
+            self.send_request(sock, "sync:")
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _send_sync_packet(self, sock, packet_id: bytes, data: bytes = b"", arg=None):
+        import struct
+
+        if arg is None:
+            arg = len(data)
+        sock.sendall(packet_id + struct.pack("<I", arg) + data)
+
+    def _read_sync_fail(self, sock, length: int):
+        message = self.read_exact(sock, length).decode("utf-8", errors="replace")
+        raise AdbProtocolError("adb sync failed: %s" % message)
+
+    def sync_stat(self, serial: str, remote_path: str):
+        """Returns (mode, size, mtime) of a remote path, mode is 0 if it does not exist."""
+        import struct
+
+        with self.open_sync(serial) as sock:
+            self._send_sync_packet(sock, b"STAT", remote_path.encode("utf-8"))
+            packet_id, mode, size, mtime = struct.unpack(
+                "<4sIII", self.read_exact(sock, 16)
+            )
+            if packet_id != b"STAT":
+                raise AdbProtocolError("Unexpected sync reply %r to STAT" % packet_id)
+            self._send_sync_packet(sock, b"QUIT")
+        return mode, size, mtime
+
+    def sync_list(self, serial: str, remote_path: str) -> List[Dict[str, Any]]:
+        import struct
+
+        ret = []
+        with self.open_sync(serial) as sock:
+            self._send_sync_packet(sock, b"LIST", remote_path.encode("utf-8"))
+            while True:
+                packet_id = self.read_exact(sock, 4)
+                if packet_id == b"FAIL":
+                    (length,) = struct.unpack("<I", self.read_exact(sock, 4))
+                    self._read_sync_fail(sock, length)
+                mode, size, mtime, name_length = struct.unpack(
+                    "<IIII", self.read_exact(sock, 16)
+                )
+                if packet_id == b"DONE":
+                    break
+                if packet_id != b"DENT":
+                    raise AdbProtocolError(
+                        "Unexpected sync reply %r to LIST" % packet_id
+                    )
+                name = self.read_exact(sock, name_length).decode(
+                    "utf-8", errors="replace"
+                )
+                if name not in [".", ".."]:
+                    ret.append(dict(name=name, mode=mode, size=size, mtime=mtime))
+            self._send_sync_packet(sock, b"QUIT")
+        return ret
+
+    def sync_pull(self, serial: str, remote_path: str) -> bytes:
+        import struct
+
+        content = bytearray()
+        with self.open_sync(serial) as sock:
+            self._send_sync_packet(sock, b"RECV", remote_path.encode("utf-8"))
+            while True:
+                packet_id, length = struct.unpack("<4sI", self.read_exact(sock, 8))
+                if packet_id == b"DATA":
+                    content.extend(self.read_exact(sock, length))
+                elif packet_id == b"DONE":
+                    break
+                elif packet_id == b"FAIL":
+                    self._read_sync_fail(sock, length)
+                else:
+                    raise AdbProtocolError(
+                        "Unexpected sync reply %r to RECV" % packet_id
+                    )
+            self._send_sync_packet(sock, b"QUIT")
+        return bytes(content)
+
+    def sync_push(
+        self, serial: str, remote_path: str, content: bytes, mode: int = 0o644
+    ):
+        import struct
+        import time
+
+        max_chunk_size = 64 * 1024
+        with self.open_sync(serial) as sock:
+            path_and_mode = "%s,%d" % (remote_path, 0o100000 | mode)  # regular file
+            self._send_sync_packet(sock, b"SEND", path_and_mode.encode("utf-8"))
+            for offset in range(0, len(content), max_chunk_size):
+                chunk = content[offset : offset + max_chunk_size]
+                self._send_sync_packet(sock, b"DATA", chunk)
+            self._send_sync_packet(sock, b"DONE", arg=int(time.time()))
+            packet_id, length = struct.unpack("<4sI", self.read_exact(sock, 8))
+            if packet_id == b"FAIL":
+                self._read_sync_fail(sock, length)
+            if packet_id != b"OKAY":
+                raise AdbProtocolError("Unexpected sync reply %r to SEND" % packet_id)
+            self._send_sync_packet(sock, b"QUIT")
+
+
+class DevicePresenceTracker:
+    # keeps the device -> state map of the adb server from the "host:track-devices" stream
+    # presence checks become lookups and waiters wake as soon as a device comes back
+    def __init__(self, adb_wrapper: "AdbWrapper", retry_interval: float = 1):
+        import threading
+
+        self.adb_wrapper = adb_wrapper
+        self.retry_interval = retry_interval
+        self.devices: Dict[str, str] = {}
+        self.synced = False
+        # neither the socket nor "adb track-devices" speak the protocol we expect
+        self.unavailable = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def ensure_started(self, timeout: float = 1) -> bool:
+        """Starts tracking on first use, returns whether the map is in sync with the adb server."""
+        with self.condition:
+            if self.unavailable:
+                return False
+            if self.thread is None:
+                self.thread = start_daemon_thread(target=self._run)
+            self.condition.wait_for(lambda: self.synced or self.unavailable, timeout)
+            return self.synced
+
+    def list_devices(self) -> Optional[List[Dict[str, str]]]:
+        """Same layout as AdbSocketClient.devices, None when not in sync."""
+        if not self.ensure_started():
+            return None
+        with self.condition:
+            return [dict(id=k, status=v) for k, v in self.devices.items()]
+
+    def is_online(self, device_id: str) -> Optional[bool]:
+        if not self.ensure_started():
+            return None
+        with self.condition:
+            return self.devices.get(device_id) == "device"
+
+    def wait_until_online(self, device_id: str, timeout: Optional[float] = None):
+        """Returns True as soon as the device is online, False on timeout or when not in sync."""
+        if not self.ensure_started():
+            return False
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.synced or self.devices.get(device_id) == "device",
+                timeout,
+            ) and self.devices.get(device_id) == "device"
+
+    def _update(self, payload: bytes):
+        devices = {}
+        for line in split_lines(payload.decode("utf-8", errors="replace")):
+            serial, state = line.split("\t", 1)
+            devices[serial] = state
+        with self.condition:
+            self.devices = devices
+            self.synced = True
+            self.condition.notify_all()
+
+    def _set_unsynced(self, unavailable=False):
+        with self.condition:
+            self.synced = False
+            self.unavailable = self.unavailable or unavailable
+            self.condition.notify_all()
+
+    def _track_via_socket(self):
+        socket_client = self.adb_wrapper.socket_client
+        with socket_client.connect(timeout=None) as sock:
+            socket_client.send_request(sock, "host:track-devices")
+            while True:
+                self._update(socket_client.read_hex_length_prefixed(sock))
+
+    def _track_via_subprocess(self):
+        # "adb track-devices" dumps the length prefixed stream as is, and starts the server if needed
+        cmd = self.adb_wrapper._build_cmd(["track-devices"], NO_DEVICE_ID)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                header = proc.stdout.read(4)  # type: ignore
+                if len(header) < 4:
+                    raise AdbProtocolError("adb track-devices exited")
+                try:
+                    length = int(header, 16)
+                except ValueError:
+                    raise AdbProtocolError(
+                        "Unexpected adb track-devices output %r" % header
+                    )
+                self._update(proc.stdout.read(length))  # type: ignore
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def _run(self):
+        import time
+
+        while True:
+            try:
+                try:
+                    self._track_via_socket()
+                except OSError:
+                    # no adb server listening yet
+                    self._track_via_subprocess()
+            except AdbProtocolError as e:
+                if not self.synced:
+                    print("Warning: device presence tracking unavailable (%s), polling instead" % e)
+                    self._set_unsynced(unavailable=True)
+                    return
+            except Exception as e:
+                print("Warning: device presence tracking interrupted:", e)
+            # the adb server went away, callers poll until the stream is back
+            self._set_unsynced()
+            time.sleep(self.retry_interval)
+
+
 class AdbWrapper:
-    def __init__(self, adb_path: str, config: omegaconf.DictConfig):
+    def __init__(
+        self,
+        adb_path: str,
+        config: omegaconf.DictConfig,
+        tracer: Optional[AdbCallTracer] = None,
+    ):
+        import threading
+
         self.adb_path = adb_path
         self.config = config
         self.device = config.get("device")
         self.remote_swm_dir = self.config.android_session_storage_path
+        self.transport = config.get("adb_transport", "subprocess")
+        self.socket_client = AdbSocketClient(
+            host=config.get("adb_server_host", "127.0.0.1"),
+            port=int(
+                os.environ.get(
+                    "ANDROID_ADB_SERVER_PORT", config.get("adb_server_port", 5037)
+                )
+            ),
+        )
+        self.file_transfer = config.get("adb_file_transfer", "subprocess")
+        self.deadlines = SubprocessDeadlines(config)
+        self.tracer = tracer if tracer is not None else AdbCallTracer()
+        self.single_flight = SingleFlight()
+        self.state_snapshot = DeviceStateSnapshot(
+            self, ttl=config.get("device_state_snapshot_ttl", 0.5)
+        )
+        self.presence = None
+        if config.get("adb_track_devices", True):
+            self.presence = DevicePresenceTracker(self)
+        self.shell_sessions: Dict[str, PersistentAdbShell] = {}
+        self.shell_sessions_lock = threading.Lock()
+        self.root_shell = config.get("adb_root_shell", True)
+        self.root_shells: Dict[str, PersistentAdbShell] = {}
+        # devices where su cannot be kept open, e.g. denied or not rooted
+        self.root_shell_unavailable = set()
         self.initialize()
         self.remote = self
 
     def terminate_app(self, app_id:str):
-        self.execute_su_cmd(f"am force-stop {app_id}")
-        self.execute_su_cmd(f"am kill {app_id}")
-        self.execute_su_cmd(f"pm disable {app_id}")
-        self.execute_su_cmd(f"pm enable {app_id}")
+        # one round trip, stops at the first failing step
+        steps = [
+            f"am force-stop {app_id}",
+            f"am kill {app_id}",
+            f"pm disable {app_id}",
+            f"pm enable {app_id}",
+        ]
+        self.execute_batch([" && ".join(steps)], su=True, check=True)
 
     def install_script_if_missing_or_mismatch(
         self, script_content: str, remote_script_path: str
@@ -2504,9 +4674,9 @@ for (UsageStats usageStats : stats.values()) {
 
     def list_recent_apps(self):
         # dumpsys activity recents  |grep 'Recent #' | grep type=standard
-        output = self.check_output_shell(["dumpsys", "activity", "recents"])
-        lines = grep_lines(output, ["Recent #"])
-        lines = grep_lines("\n".join(lines), ["type=standard"])
+        lines = self.stream_shell_lines(
+            ["dumpsys", "activity", "recents"], RecentTasksLineParser
+        )
         # parse app id from lines
         #   * Recent #0: Task{611ba52 #4446 type=standard A=10244:com.tencent.mobileqq U=0 visible=true visibleRequested=true mode=fullscreen translucent=false sz=1}
         ret = []
@@ -2569,6 +4739,12 @@ for (UsageStats usageStats : stats.values()) {
 
     def listdir(self, path: str):
         assert self.test_path_existance(path)
+        if self._can_use_sync():
+            try:
+                entries = self.socket_client.sync_list(self.device, path)
+                return sorted(it["name"] for it in entries)
+            except (ConnectionError, AdbProtocolError) as e:
+                self._warn_sync_fallback(e)
         output = self.check_output_shell(["ls", "-1", path])
         ret = split_lines(output)
         return ret
@@ -2595,6 +4771,7 @@ for (UsageStats usageStats : stats.values()) {
 
     def set_current_ime(self, ime_name: str):
         self.execute_su_cmd(f"settings put secure default_input_method {ime_name}")
+        self.state_snapshot.invalidate()
 
     def check_output_su(self, cmd: str, **kwargs):
         return self.check_output_shell(["su", "-c", cmd], **kwargs)
@@ -2615,8 +4792,9 @@ for (UsageStats usageStats : stats.values()) {
         else:
             return ret
 
-    def check_app_in_display(self, app_id: str, display_id: int):
-        display_focus = self.get_display_current_focus().get(display_id, "")
+    def check_app_in_display(self, app_id: str, display_id: int, max_age=None):
+        display_focus = self.state_snapshot.get(max_age)["display_focus"]
+        display_focus = display_focus.get(display_id, "")
         ret = (app_id + "/") in (display_focus + "/")
         return ret
 
@@ -2628,9 +4806,9 @@ for (UsageStats usageStats : stats.values()) {
         # we can get display id and current focused app per display here
         # just need to parse section "WINDOW MANAGER DISPLAY CONTENTS (dumpsys window displays)"
 
-        output = self.check_output(["shell", "dumpsys", "window", "displays"])
-        lines = grep_lines(output, ["mDisplayId", "mFocusedApp"])
-        ret = parse_display_focus(lines)
+        ret = self.stream_shell_lines(
+            ["dumpsys", "window", "displays"], DisplayFocusLineParser
+        )
         # print("Ret:", ret)
         return ret
 
@@ -2638,7 +4816,7 @@ for (UsageStats usageStats : stats.values()) {
         cmd = "wm reset -d %s" % display_id
         self.execute_su_cmd(cmd)
 
-    def check_app_is_foreground(self, app_id: str):
+    def check_app_is_foreground(self, app_id: str, max_age=None):
         # convert the binary output from "wm dump-visible-window-views" into ascii byte by byte, those not viewable into "."
         # adb shell wm dump-visible-window-views | xxd | grep <app_id>
 
@@ -2646,7 +4824,7 @@ for (UsageStats usageStats : stats.values()) {
         # adb shell "dumpsys activity activities | grep ResumedActivity" | grep <app_id>
         # topResumedActivity: on top of specific display
         # ResumedActivity: the current focused app
-        data = self.get_active_apps()
+        data = self.state_snapshot.get(max_age)["active_apps"]
         foreground_apps = data["foreground"]
         # print("Foreground apps:", foreground_apps)
         for it in foreground_apps:
@@ -2655,8 +4833,9 @@ for (UsageStats usageStats : stats.values()) {
         return False
 
     def get_active_apps(self):
-        output = self.check_output(["shell", "dumpsys", "activity", "activities"])
-        data = parse_dumpsys_active_apps(output)
+        data = self.stream_shell_lines(
+            ["dumpsys", "activity", "activities"], ActiveAppsLineParser
+        )
         return data
 
     def check_app_existance(self, app_id: str):
@@ -2671,38 +4850,15 @@ for (UsageStats usageStats : stats.values()) {
         # If both are false, the display is off.
         # If mHoldingWakeLockSuspendBlocker is false, and mHoldingDisplaySuspendBlocker is true, the display is on, but locked.
         # If both are true, the display is on.
-        output = self.check_output(["shell", "dumpsys", "power"])
-        lines = grep_lines(output, ["mHolding"])
-        data = parse_dumpsys_keyvalue_output("\n".join(lines))
-        if (
-            data.get("mHoldingWakeLockSuspendBlocker") == "false"
-            and data.get("mHoldingDisplaySuspendBlocker") == "false"
-        ):
-            ret = "off_locked"
-        elif (
-            data.get("mHoldingWakeLockSuspendBlocker") == "true"
-            and data.get("mHoldingDisplaySuspendBlocker") == "true"
-        ):
-            ret = "on_unlocked"
-        elif (
-            data.get("mHoldingWakeLockSuspendBlocker") == "true"
-            and data.get("mHoldingDisplaySuspendBlocker") == "false"
-        ):
-            ret = "on_locked"
-        elif (
-            data.get("mHoldingWakeLockSuspendBlocker") == "false"
-            and data.get("mHoldingDisplaySuspendBlocker") == "true"
-        ):
-            ret = "off_unlocked"
-        else:
-            ret = "unknown"
-        return ret
+        data = self.stream_shell_lines(["dumpsys", "power"], PowerStateLineParser)
+        return parse_display_and_lock_state(data)
 
-    def adb_keyboard_input_text(self, text: str):
+    def adb_keyboard_input_text(self, text: str, transport: Optional[str] = None):
         # adb shell am broadcast -a ADB_INPUT_B64 --es msg `echo -n '你好' | base64`
         base64_text = encode_base64_str(text)
         self.execute_shell(
-            ["am", "broadcast", "-a", "ADB_INPUT_B64", "--es", "msg", base64_text]
+            ["am", "broadcast", "-a", "ADB_INPUT_B64", "--es", "msg", base64_text],
+            transport=transport,
         )
         # TODO: restore the previously using keyboard after swm being detached, either manually or using script/apk
 
@@ -2748,6 +4904,13 @@ for (UsageStats usageStats : stats.values()) {
     def test_path_existance(self, remote_path: str):
         self.assert_absolute_path(remote_path)
 
+        if self._can_use_sync():
+            try:
+                mode, _, _ = self.socket_client.sync_stat(self.device, remote_path)
+                return mode != 0
+            except (ConnectionError, AdbProtocolError) as e:
+                self._warn_sync_fallback(e)
+
         cmd = ["shell", "test", "-e", remote_path]
         result = self.execute(cmd, check=False)
         # print("Return code:", result.returncode)
@@ -2779,22 +4942,446 @@ for (UsageStats usageStats : stats.values()) {
         cmd.extend(args)
         return cmd
 
-    def execute(
+    def execute(
+        self,
+        args: List[str],
+        capture: bool = False,
+        text=True,
+        check=True,
+        device_id=None,
+        transport: Optional[str] = None,
+        timeout: Optional[float] = None,
+        call_class: Optional[str] = None,
+    ) -> subprocess.CompletedProcess:
+        if call_class is None:
+            call_class = classify_adb_call(args)
+        if timeout is None:
+            timeout = self.deadlines.timeout_for(call_class)
+        cmd = self._build_cmd(args, device_id)
+
+        def _execute_with_deadline(check: bool):
+            return self.deadlines.run_with_retries(
+                call_class,
+                lambda: self.tracer.trace(
+                    "adb",
+                    cmd,
+                    call_class,
+                    lambda: self._execute_once(
+                        args,
+                        capture=capture,
+                        text=text,
+                        check=check,
+                        device_id=device_id,
+                        transport=transport,
+                        timeout=timeout,
+                        call_class=call_class,
+                    ),
+                ),
+            )
+
+        if not (capture and call_class == "query"):
+            return _execute_with_deadline(check)
+        # identical read-only queries in flight share one subprocess, each caller checks the exit code itself
+        result = self.single_flight.do(
+            ("execute", tuple(cmd), text, transport, timeout),
+            lambda: _execute_with_deadline(False),
+        )
+        if check:
+            result.check_returncode()
+        return result
+
+    def _execute_once(
+        self,
+        args: List[str],
+        capture: bool,
+        text: bool,
+        check: bool,
+        device_id=None,
+        transport: Optional[str] = None,
+        timeout: Optional[float] = None,
+        call_class: Optional[str] = None,
+    ) -> subprocess.CompletedProcess:
+        # an explicit transport opts out of the root shell too
+        if transport is None and self._can_use_root_shell(
+            args, device_id, call_class=call_class, capture=capture
+        ):
+            try:
+                return self._execute_via_root_shell(
+                    args,
+                    capture=capture,
+                    text=text,
+                    check=check,
+                    device_id=device_id,
+                    timeout=timeout,
+                )
+            except ShellSessionClosedError as e:
+                if isinstance(e, ShellCommandLostError) and call_class != "query":
+                    # su died mid-command, "su -c" could repeat a force-stop or a keyboard switch
+                    raise
+                print("Warning: %s, falling back to su -c" % e.args[0])
+        if transport is None:
+            transport = self.transport
+        if transport == "shell_session" and self._can_use_shell_session(
+            args, device_id
+        ):
+            try:
+                return self._execute_via_shell_session(
+                    args,
+                    capture=capture,
+                    text=text,
+                    check=check,
+                    device_id=device_id,
+                    timeout=timeout,
+                )
+            except ShellSessionClosedError as e:
+                if isinstance(e, ShellCommandLostError) and call_class != "query":
+                    # the command may have run already, running it again could repeat a mutation
+                    raise
+                print("Warning: %s, falling back to subprocess" % e.args[0])
+        elif transport == "socket" and self._can_use_socket(args, device_id):
+            try:
+                return self._execute_via_socket(
+                    args,
+                    capture=capture,
+                    text=text,
+                    check=check,
+                    device_id=device_id,
+                    timeout=timeout,
+                )
+            except (ConnectionError, AdbProtocolError) as e:
+                print(
+                    "Warning: adb server socket failed (%s), falling back to subprocess"
+                    % e
+                )
+        cmd = self._build_cmd(args, device_id)
+        # subprocess.run kills the child on timeout
+        result = subprocess.run(
+            cmd, capture_output=capture, text=text, check=check, timeout=timeout
+        )
+        return result
+
+    def _can_use_shell_session(self, args: List[str], device_id=None):
+        # only non-interactive shell commands, "-t" and friends need a real adb process
+        if device_id == NO_DEVICE_ID:
+            return False
+        if not (device_id or self.device):
+            return False
+        return len(args) > 1 and args[0] == "shell" and not args[1].startswith("-")
+
+    def _can_use_socket(self, args: List[str], device_id=None):
+        if args == ["devices"]:
+            return True
+        return self._can_use_shell_session(args, device_id)
+
+    def _execute_via_socket(
+        self,
+        args: List[str],
+        capture: bool,
+        text: bool,
+        check: bool,
+        device_id=None,
+        timeout: Optional[float] = None,
+    ):
+        import socket
+
+        if args == ["devices"]:
+            # same layout as "adb devices", list_device_ids skips the first line
+            lines = ["List of devices attached"]
+            for it in self.socket_client.devices():
+                lines.append("%s\t%s" % (it["id"], it["status"]))
+            stdout = ("\n".join(lines) + "\n\n").encode("utf-8")
+            returncode, stderr = 0, b""
+        else:
+            target_device = device_id or self.device
+            assert target_device
+            try:
+                # closing the stream on timeout makes adbd kill the remote command
+                returncode, stdout, stderr = self.socket_client.shell(
+                    target_device, " ".join(args[1:]), timeout=timeout
+                )
+            except socket.timeout:
+                raise subprocess.TimeoutExpired(
+                    self._build_cmd(args, device_id), timeout  # type: ignore
+                )
+        return self._build_completed_process(
+            args,
+            device_id,
+            returncode,
+            stdout,
+            stderr,
+            capture=capture,
+            text=text,
+            check=check,
+        )
+
+    def get_shell_session(self, device_id: str, root=False):
+        import atexit
+
+        pool = self.root_shells if root else self.shell_sessions
+        with self.shell_sessions_lock:
+            if device_id not in pool:
+                if not (self.shell_sessions or self.root_shells):
+                    atexit.register(self.close_shell_sessions)
+                pool[device_id] = PersistentAdbShell(
+                    self.adb_path, device_id, login_args=["su"] if root else []
+                )
+            return pool[device_id]
+
+    def close_shell_sessions(self):
+        for it in [*self.shell_sessions.values(), *self.root_shells.values()]:
+            it.close()
+        self.shell_sessions.clear()
+        self.root_shells.clear()
+
+    def _can_use_root_shell(
+        self, args: List[str], device_id=None, call_class: Optional[str] = None, capture=True
+    ):
+        # "adb shell su -c <cmd>", as built by execute_su_cmd, check_output_su and execute_batch
+        if not self.root_shell:
+            return False
+        # interactive or streamed output would hold the shared root shell and buffer its output
+        if call_class == "interactive" or not capture:
+            return False
+        if len(args) != 4 or args[:3] != ["shell", "su", "-c"]:
+            return False
+        if device_id == NO_DEVICE_ID:
+            return False
+        target_device = device_id or self.device
+        return bool(target_device) and target_device not in self.root_shell_unavailable
+
+    def _execute_via_root_shell(
+        self,
+        args: List[str],
+        capture: bool,
+        text: bool,
+        check: bool,
+        device_id=None,
+        timeout: Optional[float] = None,
+    ):
+        target_device = device_id or self.device
+        assert target_device
+        session = self.get_shell_session(target_device, root=True)
+        completed_runs = session.completed_runs
+        # eval does the word splitting and joining that "su -c" gets from the outer shell
+        try:
+            returncode, stdout, stderr = session.run(
+                "eval " + args[3], timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise subprocess.TimeoutExpired(
+                self._build_cmd(args, device_id), timeout  # type: ignore
+            )
+        except ShellSessionClosedError:
+            if session.completed_runs == 0 and completed_runs == 0:
+                # su never ran a command, do not respawn it on every call
+                self.root_shell_unavailable.add(target_device)
+            raise
+        return self._build_completed_process(
+            args,
+            device_id,
+            returncode,
+            stdout,
+            stderr,
+            capture=capture,
+            text=text,
+            check=check,
+        )
+
+    def _execute_via_shell_session(
+        self,
+        args: List[str],
+        capture: bool,
+        text: bool,
+        check: bool,
+        device_id=None,
+        timeout: Optional[float] = None,
+    ):
+        target_device = device_id or self.device
+        assert target_device
+        session = self.get_shell_session(target_device)
+        # "adb shell" joins its arguments with spaces without escaping, so do we
+        try:
+            returncode, stdout, stderr = session.run(
+                " ".join(args[1:]), timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            # the session is closed by now, which kills the command
+            raise subprocess.TimeoutExpired(
+                self._build_cmd(args, device_id), timeout  # type: ignore
+            )
+        return self._build_completed_process(
+            args,
+            device_id,
+            returncode,
+            stdout,
+            stderr,
+            capture=capture,
+            text=text,
+            check=check,
+        )
+
+    def _build_completed_process(
+        self,
+        args: List[str],
+        device_id,
+        returncode: int,
+        stdout: bytes,
+        stderr: bytes,
+        capture: bool,
+        text: bool,
+        check: bool,
+    ):
+        # mimic subprocess.run for the output of transports other than subprocess
+        import sys
+
+        stdout = stdout.decode("utf-8", errors="replace") if text else stdout
+        stderr = stderr.decode("utf-8", errors="replace") if text else stderr
+        if not capture:
+            if text:
+                sys.stdout.write(stdout)
+                sys.stderr.write(stderr)
+            else:
+                sys.stdout.buffer.write(stdout)
+                sys.stderr.buffer.write(stderr)
+            stdout = stderr = None
+        result = subprocess.CompletedProcess(
+            self._build_cmd(args, device_id), returncode, stdout, stderr
+        )
+        if check:
+            result.check_returncode()
+        return result
+
+    def check_output(self, args: List[str], device_id=None, **kwargs) -> str:
+        return self.execute(
+            args, capture=True, device_id=device_id, **kwargs
+        ).stdout.strip()
+
+    def stream_shell_lines(
+        self, cmd_args: List[str], parser_factory, device_id=None, device_filter=True
+    ):
+        """Feed the output of a read-only shell command line by line into a fresh parser, returns its result."""
+        cmd = " ".join(cmd_args)
+        if device_filter and parser_factory.device_filter:
+            # grep exits with 1 when nothing matches, which is not an error here
+            cmd = "%s | %s || true" % (cmd, parser_factory.device_filter)
+        if self.transport != "subprocess" and self._can_use_shell_session(
+            ["shell", cmd], device_id
+        ):
+            # persistent transports are cheaper than a new adb process, even without streaming
+            output = self.check_output(
+                ["shell", cmd], device_id=device_id, call_class="query"
+            )
+            return feed_lines_to_parser(output.splitlines(), parser_factory())
+        import copy
+
+        call_class = "query"
+        timeout = self.deadlines.timeout_for(call_class)
+        result = self.single_flight.do(
+            ("stream", cmd, parser_factory, device_id or self.device),
+            lambda: self.deadlines.run_with_retries(
+                call_class,
+                lambda: self._stream_shell_lines_once(
+                    cmd, parser_factory(), device_id=device_id, timeout=timeout
+                ),
+            ),
+        )
+        # every caller of a shared run gets a result of its own to modify
+        return copy.deepcopy(result)
+
+    def _stream_shell_lines_once(
+        self,
+        cmd: str,
+        parser: IncrementalLineParser,
+        device_id=None,
+        timeout: Optional[float] = None,
+    ):
+        import threading
+
+        # exec-out is not line buffered by a pty and keeps "\n" untouched
+        full_cmd = self._build_cmd(["exec-out", cmd], device_id)
+        token = self.tracer.start("adb", full_cmd, "query")
+        bytes_read = 0
+        timed_out = threading.Event()
+        proc = subprocess.Popen(
+            full_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        def kill_on_deadline():
+            timed_out.set()
+            proc.kill()
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, kill_on_deadline)
+            timer.daemon = True
+            timer.start()
+        try:
+            assert proc.stdout
+            for line in proc.stdout:
+                bytes_read += len(line)
+                parser.feed(line.decode("utf-8", errors="replace"))
+                if parser.done:
+                    break
+        except BaseException as e:
+            self.tracer.finish(token, error=e, bytes_out=bytes_read)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if proc.poll() is None:
+                # the parser has what it needs, do not transfer the rest
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()  # type: ignore
+            stderr = proc.stderr.read()  # type: ignore
+            proc.stderr.close()  # type: ignore
+        if timed_out.is_set() and not parser.done:
+            error = subprocess.TimeoutExpired(full_cmd, timeout)  # type: ignore
+            self.tracer.finish(token, error=error, bytes_out=bytes_read)
+            raise error
+        if proc.returncode != 0 and not parser.done:
+            # e.g. device offline, an empty result would read as "nothing running"
+            error = subprocess.CalledProcessError(
+                proc.returncode, full_cmd, stderr=stderr.decode("utf-8", errors="replace")
+            )
+            self.tracer.finish(token, error=error, bytes_out=bytes_read)
+            raise error
+        self.tracer.finish(
+            token,
+            result=subprocess.CompletedProcess(full_cmd, proc.returncode),
+            bytes_out=bytes_read,
+        )
+        return parser.result()
+
+    def execute_batch(
         self,
-        args: List[str],
-        capture: bool = False,
-        text=True,
-        check=True,
+        commands: List[str],
+        su=False,
+        check=False,
         device_id=None,
-    ) -> subprocess.CompletedProcess:
-        cmd = self._build_cmd(args, device_id)
-        result = subprocess.run(cmd, capture_output=capture, text=text, check=check)
-        return result
+        call_class: Optional[str] = None,
+    ) -> List[subprocess.CompletedProcess]:
+        """Run independent shell commands in one device round trip, one result per command."""
+        if not commands:
+            return []
+        args, marker, call_class = build_shell_batch(
+            commands, su=su, call_class=call_class
+        )
+        result = self.execute(
+            args,
+            capture=True,
+            text=False,
+            check=False,
+            device_id=device_id,
+            call_class=call_class,
+        )
+        return split_shell_batch_output(commands, result, marker, check=check)
 
-    def check_output(self, args: List[str], device_id=None, **kwargs) -> str:
-        return self.execute(
-            args, capture=True, device_id=device_id, **kwargs
-        ).stdout.strip()
+    def _can_use_sync(self):
+        return self.file_transfer == "sync" and bool(self.device)
+
+    def _warn_sync_fallback(self, error: Exception):
+        print("Warning: adb sync failed (%s), falling back to subprocess" % error)
 
     def read_file(self, remote_path: str) -> str:
         """Read a remote file's content as a string."""
@@ -2802,6 +5389,13 @@ for (UsageStats usageStats : stats.values()) {
 
         self.assert_absolute_path(remote_path)
 
+        if self._can_use_sync():
+            try:
+                content = self.socket_client.sync_pull(self.device, remote_path)
+                return content.decode("utf-8")
+            except (ConnectionError, AdbProtocolError) as e:
+                self._warn_sync_fallback(e)
+
         with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
             tmp_path = tmp_file.name
         try:
@@ -2817,6 +5411,15 @@ for (UsageStats usageStats : stats.values()) {
         self.assert_absolute_path(remote_path)
 
         """Write a string to a remote file."""
+        if self._can_use_sync():
+            try:
+                self.socket_client.sync_push(
+                    self.device, remote_path, content.encode("utf-8")
+                )
+                return
+            except (ConnectionError, AdbProtocolError) as e:
+                self._warn_sync_fallback(e)
+
         with tempfile.NamedTemporaryFile(mode="w", delete=False) as tmp_file:
             tmp_path = tmp_file.name
             tmp_file.write(content)
@@ -2860,7 +5463,12 @@ for (UsageStats usageStats : stats.values()) {
         return self.execute_su_cmd(cmd, **kwargs)
 
     def enable_and_set_specific_keyboard(self, keyboard_activity_name: str):
-        if self.get_current_ime() != keyboard_activity_name:
+        snapshot = self.state_snapshot.cached()
+        if snapshot is not None:
+            current_ime = snapshot["current_ime"]
+        else:
+            current_ime = self.get_current_ime()
+        if current_ime != keyboard_activity_name:
             self.enable_keyboard_su(keyboard_activity_name)
             self.set_keyboard_su(keyboard_activity_name)
 
@@ -2869,9 +5477,11 @@ for (UsageStats usageStats : stats.values()) {
 
     def disable_keyboard_su(self, keyboard_activity_name: str):
         self.execute_su_cmd("ime disable %s" % keyboard_activity_name)
+        self.state_snapshot.invalidate()
 
     def set_keyboard_su(self, keyboard_activity_name: str):
         self.execute_su_cmd("ime set %s" % keyboard_activity_name)
+        self.state_snapshot.invalidate()
 
     def download_gboard_apk(self, gboard_bin_id: str):
         import requests
@@ -2969,11 +5579,12 @@ for (UsageStats usageStats : stats.values()) {
             cmd = ["su", "-c", "sh '%s'" % sh_tmp_path]
         else:
             cmd = ["sh", sh_tmp_path]
+        # user code may run for as long as it likes
         if capture_output:
-            ret = self.check_output_shell(cmd)
+            ret = self.check_output_shell(cmd, call_class="interactive")
             return ret
         else:
-            self.execute_shell(cmd)
+            self.execute_shell(cmd, call_class="interactive")
 
     def get_app_apk_path(self, app_id: str):
         ret = None
@@ -3200,7 +5811,14 @@ out.close();
         status_blacklist: list[str] = ["unauthorized", "fastboot"],
         with_status: bool = False,
     ) -> List:
-        output = self.check_output(["devices"], device_id=NO_DEVICE_ID)
+        tracked = self.presence.list_devices() if self.presence else None
+        if tracked is not None:
+            # same layout as "adb devices", read from memory
+            lines = ["List of devices attached"]
+            lines.extend("%s\t%s" % (it["id"], it["status"]) for it in tracked)
+            output = "\n".join(lines)
+        else:
+            output = self.check_output(["devices"], device_id=NO_DEVICE_ID)
         devices = []
         for line in output.splitlines()[1:]:
             if line.strip() and "device" in line:
@@ -3219,55 +5837,848 @@ out.close();
                     )
         return devices
 
-    def list_device_detailed(self) -> List[str]:
-        device_infos = self.list_device_ids(with_status=True)
-        for it in device_infos:
-            device_id = it["id"]
-            device_name = self.get_device_name(device_id)
-            it["name"] = device_name
-        return device_infos
+    def list_device_detailed(self) -> List[str]:
+        device_infos = self.list_device_ids(with_status=True)
+        for it in device_infos:
+            device_id = it["id"]
+            device_name = self.get_device_name(device_id)
+            it["name"] = device_name
+        return device_infos
+
+    def list_packages(self) -> List[str]:
+        output = self.check_output(["shell", "pm", "list", "packages"])
+        packages = []
+        for line in output.splitlines():
+            if line.startswith("package:"):
+                packages.append(line[len("package:") :].strip())
+        return packages
+
+    def ensure_dir_existance(self, dir_path: str):
+        self.assert_absolute_path(dir_path)
+        if self.test_path_existance(dir_path):
+            return
+        print("Directory %s not found, creating it now..." % dir_path)
+        self.create_dirs(dir_path)
+
+    def create_swm_dir(self):
+        swm_dir = self.remote_swm_dir
+        self.ensure_dir_existance(swm_dir)
+
+    def create_dirs(self, dirpath: str):
+        self.assert_absolute_path(dirpath)
+        self.execute(["shell", "mkdir", "-p", dirpath])
+
+    def push_aapt_su(self, target_path_su: str):
+        self.assert_absolute_path(target_path_su)
+        device_path = os.path.join(self.config.android_session_storage_path, "aapt")
+        device_architecture = self.get_device_architecture()
+        bin_arch = get_android_bin_arch(device_architecture)
+        local_aapt_path = os.path.join(
+            self.config.cache_dir, "android-binaries", "aapt", "aapt-%s" % bin_arch
+        )
+        self.execute(["push", local_aapt_path, device_path])
+        self.execute_su_cmd("cp %s %s" % (device_path, target_path_su))
+        self.execute_su_cmd("chmod 700 %s" % target_path_su)
+
+    def pull_session(self, session_name: str, local_path: str):
+        self.assert_absolute_path(local_path)
+        remote_path = os.path.join(
+            self.config.android_session_storage_path, session_name
+        )
+        self.pull_file(remote_path, local_path)
+
+
+class DeviceStateSnapshot:
+    # focus, power and ime state of a device captured in one batched sweep, shared by all consumers for ttl seconds
+    sweep_commands = {
+        "active_apps": (
+            "dumpsys activity activities | " + ActiveAppsLineParser.device_filter
+        ),
+        "display_focus": (
+            "dumpsys window displays | " + DisplayFocusLineParser.device_filter
+        ),
+        "power": "dumpsys power | grep mHolding",
+        "current_ime": "settings get secure default_input_method",
+    }
+
+    def __init__(self, adb_wrapper: "AdbWrapper", ttl: float = 0.5):
+        import threading
+
+        self.adb_wrapper = adb_wrapper
+        self.ttl = ttl
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        # one sweep at a time, concurrent callers wait for it and share the result
+        self.lock = threading.Lock()
+
+    def get(self, max_age: Optional[float] = None, device_id=None) -> Dict[str, Any]:
+        """Returns a snapshot not older than max_age seconds (default: ttl), 0 forces a new sweep."""
+        import time
+
+        if max_age is None:
+            max_age = self.ttl
+        device_id = device_id or self.adb_wrapper.device
+        assert device_id
+        requested_at = time.monotonic()
+        with self.lock:
+            snapshot = self.lookup(device_id, requested_at, max_age)
+            if snapshot is not None:
+                return snapshot
+            snapshot = self.sweep(device_id)
+            self.snapshots[device_id] = snapshot
+            return snapshot
+
+    def cached(self, max_age: Optional[float] = None, device_id=None):
+        """Returns a snapshot not older than max_age seconds if one is cached, never sweeps."""
+        import time
+
+        if max_age is None:
+            max_age = self.ttl
+        device_id = device_id or self.adb_wrapper.device
+        if not device_id:
+            return None
+        return self.lookup(device_id, time.monotonic(), max_age)
+
+    def lookup(self, device_id: str, requested_at: float, max_age: float):
+        # age counts from the start of the sweep, so callers that waited for a
+        # sweep in flight share it while max_age=0 still gets a sweep of its own
+        snapshot = self.snapshots.get(device_id)
+        if snapshot is not None and requested_at - snapshot["started_at"] <= max_age:
+            return snapshot
+        return None
+
+    def invalidate(self, device_id=None):
+        with self.lock:
+            if device_id is None:
+                self.snapshots.clear()
+            else:
+                self.snapshots.pop(device_id, None)
+
+    def sweep(self, device_id: str):
+        import time
+
+        started_at = time.monotonic()
+        names = list(self.sweep_commands.keys())
+        results = self.adb_wrapper.execute_batch(
+            [self.sweep_commands[it] for it in names],
+            device_id=device_id,
+            call_class="query",
+        )
+        return self.parse_sweep(names, results, started_at)
+
+    @staticmethod
+    def parse_sweep(
+        names: List[str], results: List[subprocess.CompletedProcess], started_at: float
+    ):
+        import time
+
+        outputs = {name: result.stdout for name, result in zip(names, results)}
+        power = feed_lines_to_parser(
+            outputs["power"].splitlines(), PowerStateLineParser()
+        )
+        return {
+            "active_apps": feed_lines_to_parser(
+                outputs["active_apps"].splitlines(), ActiveAppsLineParser()
+            ),
+            "display_focus": feed_lines_to_parser(
+                outputs["display_focus"].splitlines(), DisplayFocusLineParser()
+            ),
+            "display_and_lock_state": parse_display_and_lock_state(power),
+            "current_ime": outputs["current_ime"].strip(),
+            "started_at": started_at,
+            "captured_at": time.monotonic(),
+        }
+
+
+class AsyncLoopThread:
+    # a single event loop running in a daemon thread, shared by the coroutine based sidecars
+    def __init__(self):
+        import asyncio
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = start_daemon_thread(target=self._run)
+
+    def _run(self):
+        import asyncio
+
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        import asyncio
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._report_exception)
+        return future
+
+    def run(self, coro):
+        """Blocks the calling thread, which must not be the loop thread, until coro is done."""
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _report_exception(self, future):
+        import traceback
+
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+
+
+class AsyncAdbWrapper:
+    # asyncio counterpart of AdbWrapper for the read-only queries issued by monitors
+    def __init__(self, adb_wrapper: AdbWrapper, max_concurrency_per_device: int = 4):
+        self.adb_wrapper = adb_wrapper
+        self.max_concurrency_per_device = max_concurrency_per_device
+        self.semaphores: Dict[Any, Any] = {}
+        self.sweep_locks: Dict[Any, Any] = {}
+        # single flight for identical queries, tasks keyed by loop and command
+        self.inflight: Dict[Any, Any] = {}
+
+    def _get_sweep_lock(self, device_id: str):
+        import asyncio
+
+        key = (id(asyncio.get_running_loop()), device_id)
+        if key not in self.sweep_locks:
+            self.sweep_locks[key] = asyncio.Lock()
+        return self.sweep_locks[key]
+
+    def _get_semaphore(self, device_id=None):
+        import asyncio
+
+        # semaphores belong to the running loop
+        key = (id(asyncio.get_running_loop()), device_id or self.adb_wrapper.device)
+        if key not in self.semaphores:
+            self.semaphores[key] = asyncio.Semaphore(self.max_concurrency_per_device)
+        return self.semaphores[key]
+
+    async def execute(
+        self,
+        args: List[str],
+        capture: bool = False,
+        text=True,
+        check=True,
+        device_id=None,
+        timeout: Optional[float] = None,
+        call_class: Optional[str] = None,
+    ) -> subprocess.CompletedProcess:
+        import asyncio
+
+        deadlines = self.adb_wrapper.deadlines
+        if call_class is None:
+            call_class = classify_adb_call(args)
+        if timeout is None:
+            timeout = deadlines.timeout_for(call_class)
+        if not (capture and call_class == "query"):
+            return await self._execute_with_deadline(
+                args, capture, text, check, device_id, timeout, call_class
+            )
+        cmd = self.adb_wrapper._build_cmd(args, device_id)
+        key = (id(asyncio.get_running_loop()), tuple(cmd), text, timeout)
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._execute_with_deadline(
+                    args, capture, text, False, device_id, timeout, call_class
+                )
+            )
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.adb_wrapper.single_flight.record_shared_call()
+        # a cancelled caller must not cancel the query for the others
+        result = await asyncio.shield(task)
+        if check:
+            result.check_returncode()
+        return result
+
+    async def _execute_with_deadline(
+        self,
+        args: List[str],
+        capture: bool,
+        text: bool,
+        check: bool,
+        device_id,
+        timeout: Optional[float],
+        call_class: str,
+    ) -> subprocess.CompletedProcess:
+        import asyncio
+
+        deadlines = self.adb_wrapper.deadlines
+        retries = deadlines.retries_for(call_class)
+        tracer = self.adb_wrapper.tracer
+        cmd = self.adb_wrapper._build_cmd(args, device_id)
+        for attempt in range(retries + 1):
+            token = tracer.start("adb", cmd, call_class)
+            try:
+                result = await self._execute_once(
+                    args, capture, text, check, device_id, timeout
+                )
+                tracer.finish(token, result=result)
+                return result
+            except BaseException as e:
+                tracer.finish(token, error=e)
+                if not isinstance(e, subprocess.TimeoutExpired):
+                    raise
+                deadlines.record_timeout(call_class, e.cmd, timeout)  # type: ignore
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(deadlines.backoff_delay(attempt))
+        raise AssertionError("unreachable")
+
+    async def _execute_once(
+        self,
+        args: List[str],
+        capture: bool,
+        text: bool,
+        check: bool,
+        device_id=None,
+        timeout: Optional[float] = None,
+    ) -> subprocess.CompletedProcess:
+        import asyncio
+
+        cmd = self.adb_wrapper._build_cmd(args, device_id)
+        pipe = asyncio.subprocess.PIPE if capture else None
+        async with self._get_semaphore(device_id):
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=pipe, stderr=pipe)
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise subprocess.TimeoutExpired(cmd, timeout)  # type: ignore
+            except asyncio.CancelledError:
+                # do not leave adb processes behind a cancelled task
+                proc.kill()
+                await proc.wait()
+                raise
+        if capture and text:
+            stdout = stdout.decode("utf-8", errors="replace")
+            stderr = stderr.decode("utf-8", errors="replace")
+        result = subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)  # type: ignore
+        if check:
+            result.check_returncode()
+        return result
+
+    async def check_output(self, args: List[str], device_id=None, **kwargs) -> str:
+        result = await self.execute(args, capture=True, device_id=device_id, **kwargs)
+        return result.stdout.strip()
+
+    async def check_output_shell(self, cmd_args: List[str], **kwargs) -> str:
+        return await self.check_output(["shell", *cmd_args], **kwargs)
+
+    async def list_device_ids(self) -> List[str]:
+        output = await self.check_output(["devices"], device_id=NO_DEVICE_ID)
+        ret = []
+        for line in output.splitlines()[1:]:
+            elements = line.split()
+            if len(elements) >= 2 and elements[1] == "device":
+                ret.append(elements[0])
+        return ret
+
+    async def check_device_online(self, device_id: str):
+        import asyncio
+
+        presence = self.adb_wrapper.presence
+        if presence is not None:
+            online = await asyncio.to_thread(presence.is_online, device_id)
+            if online is not None:
+                return online
+        return device_id in await self.list_device_ids()
+
+    async def parse_shell_output(self, cmd_args: List[str], parser_factory):
+        # filtered on the device, grep exits with 1 when nothing matches
+        cmd = " ".join(cmd_args)
+        if parser_factory.device_filter:
+            cmd = "%s | %s || true" % (cmd, parser_factory.device_filter)
+        output = await self.check_output_shell([cmd], call_class="query")
+        return feed_lines_to_parser(output.splitlines(), parser_factory())
+
+    async def get_active_apps(self):
+        return await self.parse_shell_output(
+            ["dumpsys", "activity", "activities"], ActiveAppsLineParser
+        )
+
+    async def get_display_current_focus(self):
+        return await self.parse_shell_output(
+            ["dumpsys", "window", "displays"], DisplayFocusLineParser
+        )
+
+    async def execute_batch(
+        self,
+        commands: List[str],
+        su=False,
+        check=False,
+        device_id=None,
+        call_class: Optional[str] = None,
+    ) -> List[subprocess.CompletedProcess]:
+        if not commands:
+            return []
+        args, marker, call_class = build_shell_batch(
+            commands, su=su, call_class=call_class
+        )
+        result = await self.execute(
+            args,
+            capture=True,
+            text=False,
+            check=False,
+            device_id=device_id,
+            call_class=call_class,
+        )
+        return split_shell_batch_output(commands, result, marker, check=check)
+
+    async def get_state_snapshot(self, max_age: Optional[float] = None, device_id=None):
+        import time
+
+        state_snapshot = self.adb_wrapper.state_snapshot
+        if max_age is None:
+            max_age = state_snapshot.ttl
+        device_id = device_id or self.adb_wrapper.device
+        assert device_id
+        requested_at = time.monotonic()
+        # windows polling the same device share one sweep, the cache is shared with synchronous callers
+        async with self._get_sweep_lock(device_id):
+            snapshot = state_snapshot.lookup(device_id, requested_at, max_age)
+            if snapshot is not None:
+                return snapshot
+            started_at = time.monotonic()
+            names = list(state_snapshot.sweep_commands.keys())
+            results = await self.execute_batch(
+                [state_snapshot.sweep_commands[it] for it in names],
+                device_id=device_id,
+                call_class="query",
+            )
+            snapshot = state_snapshot.parse_sweep(names, results, started_at)
+            state_snapshot.snapshots[device_id] = snapshot
+            return snapshot
+
+    @staticmethod
+    def snapshot_app_is_foreground(snapshot: Dict[str, Any], app_id: str):
+        data = snapshot["active_apps"]
+        return any((app_id + "/") in (it + "/") for it in data["foreground"])
+
+    @staticmethod
+    def snapshot_app_in_display(snapshot: Dict[str, Any], app_id: str, display_id: int):
+        display_focus = snapshot["display_focus"].get(display_id, "")
+        return (app_id + "/") in (display_focus + "/")
+
+    async def check_app_is_foreground(self, app_id: str, max_age=None):
+        snapshot = await self.get_state_snapshot(max_age)
+        return self.snapshot_app_is_foreground(snapshot, app_id)
+
+    async def check_app_in_display(self, app_id: str, display_id: int, max_age=None):
+        snapshot = await self.get_state_snapshot(max_age)
+        return self.snapshot_app_in_display(snapshot, app_id, display_id)
+
+
+class DeviceEventStream:
+    # long running logcat over the events buffer, reports focus, resume and death events as they happen
+    def __init__(self, adb_wrapper: "AdbWrapper", device_id: str, on_event):
+        self.adb_wrapper = adb_wrapper
+        self.device_id = device_id
+        self.on_event = on_event
+        self.proc = None
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    def _build_cmd(self):
+        # -T 1 skips the backlog, filtering by tag keeps the stream quiet
+        filterspecs = ["%s:I" % it for it in DEVICE_EVENT_LOG_TAGS] + ["*:S"]
+        args = ["logcat", "-b", "events", "-v", "tag", "-T", "1", *filterspecs]
+        return self.adb_wrapper._build_cmd(args, self.device_id)
+
+    async def run(self):
+        import asyncio
+
+        self.proc = await asyncio.create_subprocess_exec(
+            *self._build_cmd(),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                line = await self.proc.stdout.readline()  # type: ignore
+                if not line:  # device gone or logcat unsupported
+                    break
+                event = parse_event_log_line(line.decode("utf-8", errors="replace"))
+                if event is not None:
+                    self.on_event(event)
+        finally:
+            if self.proc.returncode is None:
+                self.proc.kill()
+            await self.proc.wait()
+
+    def stop(self):
+        if self.alive:
+            self.proc.kill()  # type: ignore
+
+
+class AdaptivePollInterval:
+    # fast right after something happened, backs off exponentially while nothing changes
+    def __init__(self, minimum: float = 0.5, maximum: float = 5, factor: float = 2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.current = minimum
+
+    def reset(self):
+        self.current = self.minimum
+
+    def backoff(self, ceiling: Optional[float] = None):
+        if ceiling is None:
+            ceiling = self.maximum
+        self.current = min(self.current * self.factor, ceiling)
+
+
+def assign_video_budgets(
+    focused_flags: List[bool], settings: Dict[str, Any]
+) -> List[Optional[Dict[str, Any]]]:
+    # None leaves a window at scrcpy defaults, background windows share what the focused ones leave over
+    full_fps = settings.get("focused_max_fps", 60)
+    full_rate = settings.get("focused_bit_rate_mbps", 8)
+    fps_budget = settings.get("encoder_fps_budget", 180)
+    rate_budget = settings.get("bit_rate_budget_mbps", 32)
+    count = len(focused_flags)
+    if count * full_fps <= fps_budget and count * full_rate <= rate_budget:
+        return [None] * count
+    focused_count = sum(1 for it in focused_flags if it)
+    background_count = count - focused_count
+    if not background_count:
+        return [None] * count
+    fps_left = max(fps_budget - focused_count * full_fps, 0)
+    rate_left = max(rate_budget - focused_count * full_rate, 0)
+    background = dict(
+        max_fps=max(settings.get("min_fps", 1), min(full_fps, fps_left // background_count)),
+        video_bit_rate_mbps=max(0.5, min(full_rate, round(rate_left / background_count, 1))),
+        max_size=settings.get("background_max_size", 1024),
+    )
+    return [None if it else dict(background) for it in focused_flags]
+
+
+def video_budgets_differ(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]):
+    # relaunching is disruptive, small shifts of the background share are not worth it
+    if a is None or b is None:
+        return (a is None) != (b is None)
+    for key in ["max_fps", "video_bit_rate_mbps"]:
+        low, high = sorted([a[key], b[key]])
+        if high >= 2 * low:
+            return True
+    return a["max_size"] != b["max_size"]
+
+
+class ScrcpyGovernor:
+    # splits the encoder and usb budget of a device between its windows, the focused one runs at full rate
+    # scrcpy cannot change rates on the fly, so a window is relaunched once its budget settles
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self.promote_after = settings.get("promote_after", 1)
+        self.demote_after = settings.get("demote_after", 15)
+        self.min_lifetime = settings.get("min_lifetime", 10)
+
+    def update(self, procs: List[subprocess.Popen], states: List[Dict[str, Any]]):
+        import time
+
+        now = time.time()
+        budgets = assign_video_budgets(
+            [bool(it.get("app_focused")) for it in states], self.settings
+        )
+        candidates = []
+        for proc, budget in zip(procs, budgets):
+            current = getattr(proc, "video_budget", None)
+            if not video_budgets_differ(current, budget):
+                setattr(proc, "video_budget_pending_since", None)
+                continue
+            pending_since = getattr(proc, "video_budget_pending_since", None)
+            if pending_since is None:
+                pending_since = now
+                setattr(proc, "video_budget_pending_since", now)
+            settle = self.promote_after if budget is None else self.demote_after
+            started_at = getattr(proc, "started_at", now)
+            if now - pending_since >= settle and now - started_at >= self.min_lifetime:
+                candidates.append((proc, budget))
+        # one relaunch per pass, promotions first
+        candidates.sort(key=lambda it: it[1] is not None)
+        for proc, budget in candidates[:1]:
+            print(
+                "Governor: relaunching %s with video budget %s"
+                % (getattr(proc, "app_id"), budget)
+            )
+            setattr(proc, "next_video_budget", budget)
+            setattr(proc, "terminate_reason", "governor_reconfigure")
+            proc.terminate()
+
+
+class DeviceMonitor:
+    # one polling loop per device on the shared event loop, windows subscribe instead of polling on their own
+    # polling backs off while window states stay the same, launches, events and scrcpy output reset it
+    # with the event stream up, backoff goes further since events wake the loop anyway
+    def __init__(
+        self,
+        swm: "SWM",
+        device_id: str,
+        interval: float = 0.5,
+        event_stream: bool = True,
+        event_interval: float = 30,
+        max_interval: float = 5,
+        backoff_factor: float = 2,
+        governor: Optional[ScrcpyGovernor] = None,
+    ):
+        import threading
+
+        self.swm = swm
+        self.device_id = device_id
+        self.governor = governor
+        self.poll = AdaptivePollInterval(interval, max_interval, backoff_factor)
+        self.event_interval = event_interval
+        self.last_states: Dict[int, Dict[str, Any]] = {}
+        self.subscriptions: Dict[int, Any] = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.event_stream = None
+        if event_stream:
+            self.event_stream = DeviceEventStream(
+                swm.adb_wrapper, device_id, self.on_event
+            )
+        self.event_stream_task = None
+        self.event_stream_started_at = 0.0
+        self.pending_events: List[Dict[str, Any]] = []
+        self.wakeup = None
+
+    def subscribe(self, proc: subprocess.Popen, callback):
+        """callback(proc, state) is a coroutine function, called once per pass until the window is gone."""
+        with self.lock:
+            self.subscriptions[proc.pid] = (proc, callback)
+            if self.running:
+                # a launching window wants fast passes
+                self.poke()
+                return
+            self.running = True
+        self.swm.async_loop_thread.submit(self.run())
+
+    def poke(self, force=False):
+        """Back to fast polling, thread safe, e.g. on scrcpy output. force runs a pass right away."""
+        if self.wakeup is None:
+            return
+        if self.poll.current == self.poll.minimum and not force:
+            return
+        self.poll.reset()
+        self.swm.async_loop_thread.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def unsubscribe(self, proc: subprocess.Popen):
+        with self.lock:
+            self.subscriptions.pop(proc.pid, None)
+
+    def window_gone(self, proc: subprocess.Popen):
+        if proc.poll() is not None:
+            return True
+        return hasattr(proc, "terminate_reason") or hasattr(proc, "device_disconnected")
+
+    def on_event(self, event: Dict[str, Any]):
+        # called on the loop thread by the event stream
+        self.pending_events.append(event)
+        self.poll.reset()
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    @property
+    def event_stream_alive(self):
+        return self.event_stream is not None and self.event_stream.alive
+
+    def ensure_event_stream(self) -> bool:
+        import asyncio
+        import time
+
+        if self.event_stream is None:
+            return False
+        if self.event_stream_task is None or self.event_stream_task.done():
+            # a stream that keeps dying (offline, no logcat) is retried at most every max interval
+            now = time.monotonic()
+            if now - self.event_stream_started_at < self.poll.maximum:
+                return False
+            self.event_stream_started_at = now
+            self.event_stream_task = asyncio.ensure_future(self.event_stream.run())
+        return self.event_stream.alive
+
+    async def wait_for_next_pass(self) -> List[Dict[str, Any]]:
+        import asyncio
+
+        ceiling = self.event_interval if self.ensure_event_stream() else self.poll.maximum
+        interval = min(self.poll.current, ceiling)
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), interval)  # type: ignore
+            # focus, resume and death come in bursts, take them in one pass
+            await asyncio.sleep(0.05)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()  # type: ignore
+        events, self.pending_events = self.pending_events, []
+        return events
+
+    async def run(self):
+        import asyncio
+
+        self.wakeup = asyncio.Event()
+        try:
+            while True:
+                events = await self.wait_for_next_pass()
+                with self.lock:
+                    for pid, (proc, _) in list(self.subscriptions.items()):
+                        if self.window_gone(proc):
+                            del self.subscriptions[pid]
+                            self.last_states.pop(pid, None)
+                            self.swm.control_ports.forget(pid)
+                    if not self.subscriptions:
+                        self.running = False
+                        return
+                    subscriptions = list(self.subscriptions.values())
+                await self.run_pass(subscriptions, events)
+        finally:
+            if self.event_stream is not None:
+                self.event_stream.stop()
+
+    async def run_pass(self, subscriptions: list, events: List[Dict[str, Any]]):
+        import asyncio
+
+        try:
+            # the snapshot may predate the event, sweep again
+            states = await self.evaluate(
+                [proc for proc, _ in subscriptions],
+                max_age=0 if events else None,
+                events=events,
+            )
+        except subprocess.TimeoutExpired:
+            # a wedged query says nothing about the windows, keep their last state
+            return
+        changed = False
+        for (proc, _), state in zip(subscriptions, states):
+            if self.last_states.get(proc.pid) != state:
+                changed = True
+            self.last_states[proc.pid] = state
+        if changed:
+            self.poll.reset()
+        else:
+            ceiling = self.event_interval if self.event_stream_alive else None
+            self.poll.backoff(ceiling)
+        if self.governor is not None:
+            # focus is only known while the device is online
+            procs = [proc for (proc, _), state in zip(subscriptions, states) if "app_focused" in state]
+            if procs:
+                self.governor.update(procs, [it for it in states if "app_focused" in it])
+        await asyncio.gather(
+            *[
+                self.dispatch(callback, proc, state)
+                for (proc, callback), state in zip(subscriptions, states)
+            ]
+        )
+
+    async def dispatch(self, callback, proc: subprocess.Popen, state: Dict[str, Any]):
+        import traceback
+
+        try:
+            await callback(proc, state)
+        except Exception:
+            # one broken window must not stop the others
+            traceback.print_exc()
+
+    async def evaluate(
+        self,
+        procs: List[subprocess.Popen],
+        max_age: Optional[float] = None,
+        events: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[Dict[str, Any]]:
+        # one online check and one snapshot for all windows of the device
+        async_adb_wrapper = self.swm.async_adb_wrapper
+        device_online = await async_adb_wrapper.check_device_online(self.device_id)
+        snapshot = None
+        if device_online:
+            snapshot = await async_adb_wrapper.get_state_snapshot(
+                max_age, device_id=self.device_id
+            )
+        died = set(it["app_id"] for it in events or [] if it["kind"] == "death")
+        ret = []
+        for proc in procs:
+            state: Dict[str, Any] = {"device_online": device_online}
+            if snapshot is not None:
+                app_id = getattr(proc, "app_id")
+                state["app_died"] = app_id in died
+                active_apps = snapshot["active_apps"]
+                state["app_focused"] = app_id in active_apps["focused"]
+                state["app_foreground"] = any(
+                    (app_id + "/") in (it + "/") for it in active_apps["foreground"]
+                )
+                display_id = getattr(proc, "display_id", None)
+                if display_id is not None:
+                    display_focus = snapshot["display_focus"].get(display_id, "")
+                    state["app_in_display"] = state["app_foreground"] and (
+                        (app_id + "/") in (display_focus + "/")
+                    )
+            ret.append(state)
+        return ret
+
+
+class UnicodeInputPipeline:
+    # chars scrcpy could not inject, typed through adb keyboard over the persistent shell
+    # the consumer blocks on the queue and coalesces a burst (an IME commit) into one broadcast
+    def __init__(self, adb_wrapper: "AdbWrapper", debounce: float = 0.015):
+        import queue
+
+        self.adb_wrapper = adb_wrapper
+        self.debounce = debounce
+        self.queue = queue.Queue()
+        self.latencies: List[float] = []  # seconds from put to broadcast done, per char
+        self.thread = start_daemon_thread(target=self._consume)
+
+    def put(self, chars: str):
+        import time
 
-    def list_packages(self) -> List[str]:
-        output = self.check_output(["shell", "pm", "list", "packages"])
-        packages = []
-        for line in output.splitlines():
-            if line.startswith("package:"):
-                packages.append(line[len("package:") :].strip())
-        return packages
+        self.queue.put((chars, time.monotonic()))
 
-    def ensure_dir_existance(self, dir_path: str):
-        self.assert_absolute_path(dir_path)
-        if self.test_path_existance(dir_path):
-            return
-        print("Directory %s not found, creating it now..." % dir_path)
-        self.create_dirs(dir_path)
+    def close(self, wait=False):
+        self.queue.put(None)
+        if wait:
+            self.thread.join()
 
-    def create_swm_dir(self):
-        swm_dir = self.remote_swm_dir
-        self.ensure_dir_existance(swm_dir)
+    def _collect_batch(self, first):
+        import queue
+        import time
 
-    def create_dirs(self, dirpath: str):
-        self.assert_absolute_path(dirpath)
-        self.execute(["shell", "mkdir", "-p", dirpath])
+        batch = [first]
+        deadline = first[1] + self.debounce
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # deliver what we have, then stop
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
 
-    def push_aapt_su(self, target_path_su: str):
-        self.assert_absolute_path(target_path_su)
-        device_path = os.path.join(self.config.android_session_storage_path, "aapt")
-        device_architecture = self.get_device_architecture()
-        bin_arch = get_android_bin_arch(device_architecture)
-        local_aapt_path = os.path.join(
-            self.config.cache_dir, "android-binaries", "aapt", "aapt-%s" % bin_arch
-        )
-        self.execute(["push", local_aapt_path, device_path])
-        self.execute_su_cmd("cp %s %s" % (device_path, target_path_su))
-        self.execute_su_cmd("chmod 700 %s" % target_path_su)
+    def _consume(self):
+        import time
 
-    def pull_session(self, session_name: str, local_path: str):
-        self.assert_absolute_path(local_path)
-        remote_path = os.path.join(
-            self.config.android_session_storage_path, session_name
-        )
-        self.pull_file(remote_path, local_path)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = self._collect_batch(item)
+            text = "".join(chars for chars, _ in batch)
+            try:
+                # TODO: check if the adb keyboard is "really" activated (with the grey bar underneath the screen) programatically before broadcasting the intent
+                self.adb_wrapper.adb_keyboard_input_text(text, transport="shell_session")
+            except Exception as e:
+                print("Warning: failed to input %r with adb keyboard: %s" % (text, e))
+                continue
+            done = time.monotonic()
+            self.latencies.extend(done - queued_at for _, queued_at in batch)
 
 
 class ScrcpyWrapper:
@@ -3282,6 +6693,8 @@ class ScrcpyWrapper:
         self.adb_wrapper = swm.adb_wrapper
         self.swm = swm
         self.ime_preference = None
+        # running scrcpy processes of this wrapper by pid
+        self.procs: Dict[int, subprocess.Popen] = {}
 
     @property
     def app_list_cache_path(self):
@@ -3416,99 +6829,132 @@ class ScrcpyWrapper:
         cmd = self._build_cmd(args, basic=basic)
         spawn_and_detach_process(cmd)
 
-    def check_output(self, args: List[str], basic=False) -> str:
+    def check_output(
+        self, args: List[str], basic=False, call_class: str = "query"
+    ) -> str:
         cmd = self._build_cmd(args, basic=basic)  # ; print(cmd)
-        output = subprocess.check_output(cmd).decode("utf-8")
+        deadlines = self.adb_wrapper.deadlines
+        timeout = deadlines.timeout_for(call_class)
+        result = deadlines.run_with_retries(
+            call_class,
+            lambda: self.adb_wrapper.tracer.trace(
+                "scrcpy",
+                cmd,
+                call_class,
+                lambda: subprocess.run(
+                    cmd, capture_output=True, check=True, timeout=timeout
+                ),
+            ),
+        )
+        output = result.stdout.decode("utf-8")
         return output
 
-    def start_sidecar_app_launch_filelock_releaser(
-        self, proc: subprocess.Popen, lock, interval=0.5
-    ):
-        import time
-
-        print("Starting sidecar app launch filelock releaser")
-
-        def filelock_releaser():
-            while True:
-                time.sleep(interval)
-                # print("Looping")
-                if hasattr(proc, "terminate_reason"):
-                    break
-                if getattr(proc, "app_in_display", False):
-                    break
-            try:
-                lock.release()
-            except:
-                pass
-            try:
-                os.remove(lock.lock_file)
-            except:
-                pass
-
-        start_daemon_thread(target=filelock_releaser)
+    def release_app_launch_lock(self, proc: subprocess.Popen):
+        lock = getattr(proc, "app_launch_lock", None)
+        if lock is None:
+            return
+        setattr(proc, "app_launch_lock", None)
+        try:
+            lock.release()
+        except:
+            pass
+        try:
+            os.remove(lock.lock_file)
+        except:
+            pass
 
-    def start_sidecar_ime_activator(self, proc: subprocess.Popen, interval=0.5):
+    async def on_device_state(self, proc: subprocess.Popen, state: Dict[str, Any]):
+        """Per window reaction to a device monitor pass, replaces the per window polling sidecars."""
+        import asyncio
         import time
 
         app_id = getattr(proc, "app_id")
-
-        # proc_pid = proc.pid
-        def ime_activator():
-            # print("IME activator started")
-            if self.ime_preference not in ["gboard", "adbkeyboard"]:
+        if not getattr(proc, "control_port", None):
+            port = await asyncio.to_thread(self.swm.control_ports.lookup, proc.pid)
+            if port:
+                print("Control port:", port)
+                setattr(proc, "control_port", port)
+
+        if not state["device_online"] or "app_in_display" not in state:
+            # offline is handled by the scrcpy stderr reader, no display id before scrcpy reports it
+            return
+        display_id = getattr(proc, "display_id")
+        if getattr(proc, "app_seen_in_display", False):
+            last_app_in_display = getattr(proc, "app_in_display", True)
+        else:
+            # not landed yet, passes right after the launch must not count as the app going away
+            launch_grace = self.config.get("app_launch_grace", 15)
+            last_app_in_display = time.time() - getattr(proc, "started_at") > launch_grace
+        app_in_display = state["app_in_display"]
+        if last_app_in_display and not app_in_display:  # app terminated
+            # before terminate, analyze the current dump
+            # TODO: restart app in given display, using adb shell
+            reconfirming_times = 3
+            reconfirming_interval = 0.2
+            if state.get("app_died"):
+                # the event log saw the process die and the snapshot is fresh
+                reconfirming_times = 0
+            if not state["app_foreground"]:
+                print("App %s is not in foreground" % app_id)
+            print("App %s is not in display %s" % (app_id, display_id))
+            for trial in range(reconfirming_times):
+                await asyncio.sleep(reconfirming_interval)
                 print(
-                    "IME preference %s is not set to gboard or adbkeyboard"
-                    % self.ime_preference
+                    "App %s seems not in display %s. Reconfirming %s/%s"
+                    % (app_id, display_id, trial + 1, reconfirming_times)
                 )
-                # print("IME Activator thread stopped")
-                return
-            while True:
-                time.sleep(interval)
-                if hasattr(proc, "terminate_reason"):
-                    break
-                if hasattr(proc, "device_disconnected"):
-                    break
-                active_apps = self.adb_wrapper.get_active_apps()
-                # print("Active apps:", active_apps)
-                focused_app_ids = active_apps["focused"]  # currently only one
-                app_focused = app_id in focused_app_ids
-                setattr(proc, "app_focused", app_focused)
-                # print("App focused:", app_focused)
-                # print("IME preference:", self.ime_preference)
-                if app_focused:
-                    # check app in display
-                    app_in_display = getattr(proc, "app_in_display", False)
-                    if not app_in_display:
-                        continue
-                    if hasattr(proc, "device_disconnected"):
+                try:
+                    # the shared snapshot is what made us doubt, sweep again
+                    if await self.check_app_in_display(app_id, display_id, max_age=0):
+                        app_in_display = True
                         break
-                    if self.ime_preference == "gboard":
-                        self.adb_wrapper.enable_and_set_gboard()
-                    elif self.ime_preference == "adbkeyboard":
-                        self.adb_wrapper.enable_and_set_adb_keyboard()
-            # print("IME Activator thread stopped")
-
-        start_daemon_thread(target=ime_activator)
-
-    def start_sidecar_scrcpy_monitor_control_port(self, proc: subprocess.Popen):
-        import time
-
-        proc_pid = proc.pid
-
-        def monitor_control_port():
-            while True:
-                time.sleep(1)
-                port = get_first_laddr_port_with_pid(proc_pid)
-                if port:
-                    print("Control port:", port)
-                    setattr(proc, "control_port", port)
+                except (DeviceOfflineError, subprocess.TimeoutExpired):
+                    # cannot confirm the app is gone
+                    app_in_display = True
                     break
-
-        start_daemon_thread(monitor_control_port)
+            if not app_in_display:
+                try:
+                    active_apps, display_current_focus = await asyncio.gather(
+                        self.swm.async_adb_wrapper.get_active_apps(),
+                        self.swm.async_adb_wrapper.get_display_current_focus(),
+                    )
+                    print("Dump info before killing scrcpy:")
+                    print("Active apps:", active_apps)
+                    print("Display current focus:", display_current_focus)
+                except subprocess.TimeoutExpired:
+                    print("Timed out collecting dump info before killing scrcpy")
+                setattr(proc, "app_in_display", False)
+                proc.terminate()
+                if not hasattr(proc, "terminate_reason"):
+                    setattr(proc, "terminate_reason", "app_gone")
+                return
+        setattr(proc, "app_in_display", app_in_display)
+        setattr(proc, "app_focused", state["app_focused"])
+        if app_in_display:
+            setattr(proc, "app_seen_in_display", True)
+            # the next launch may proceed once this app shows up
+            self.release_app_launch_lock(proc)
+            profiler = getattr(proc, "launch_profiler", None)
+            if profiler:
+                profiler.mark("app_in_display")
+                profiler.finish()
+        if state["app_focused"] and app_in_display:
+            if hasattr(proc, "device_disconnected"):
+                return
+            # windows of one device may prefer different IMEs
+            ime_preference = getattr(proc, "ime_preference", self.ime_preference)
+            if ime_preference == "gboard":
+                await asyncio.to_thread(self.adb_wrapper.enable_and_set_gboard)
+            elif ime_preference == "adbkeyboard":
+                await asyncio.to_thread(self.adb_wrapper.enable_and_set_adb_keyboard)
 
     def is_device_connected(self):
         assert self.device
-        ret = self.swm.adb_wrapper.check_device_online(self.device)
+        try:
+            ret = self.swm.adb_wrapper.check_device_online(self.device)
+        except subprocess.TimeoutExpired:
+            # an adb server that cannot list devices in time is as good as offline
+            return False
         return ret
 
     def wait_for_device_reconnect(self):
@@ -3517,8 +6963,14 @@ class ScrcpyWrapper:
 
         print("Waiting for device %s to reconnect" % self.device)
 
+        presence = self.swm.adb_wrapper.presence
         while True:
-            time.sleep(0.5 + 0.5 * random.random())
+            if presence is not None and presence.wait_until_online(self.device, 1):
+                # woken by the track-devices stream
+                print("Device %s is online" % self.device)
+                break
+            if presence is None or not presence.synced:
+                time.sleep(0.5 + 0.5 * random.random())
             if self.is_device_connected():
                 print("Device %s is online" % self.device)
                 break
@@ -3532,14 +6984,42 @@ class ScrcpyWrapper:
         self.swm.adb_wrapper.install_gboard()
         self.swm.adb_wrapper.enable_and_set_gboard()
 
-    def acquire_app_launch_lock(self):
+    def acquire_app_launch_lock(self, new_display=True):
+        # held from spawn until the app shows up in its display
+        # "global" serializes every launch, "device" gives each device launch_concurrency slots,
+        # "display" does the same but launches into the main display take turns among themselves
         import filelock
+        import time
 
-        lock_path = os.path.join(self.swm.config.cache_dir, "app_launch.lock")
-
-        lock = filelock.FileLock(lock_path)
-        lock.acquire()
-        return lock
+        scope = self.config.get("launch_lock_scope", "device")
+        if scope == "global":
+            lock_path = os.path.join(self.swm.config.cache_dir, "app_launch.lock")
+            lock = filelock.FileLock(lock_path)
+            lock.acquire()
+            return lock
+        lock_dir = os.path.join(self.swm.config.cache_dir, "app_launch_locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        device_name = sanitize_file_name(self.device)
+        if scope == "display" and not new_display:
+            lock_names = ["%s.main_display" % device_name]
+        else:
+            slots = max(1, int(self.config.get("launch_concurrency", 2)))
+            lock_names = ["%s.%s" % (device_name, it) for it in range(slots)]
+        locks = [
+            filelock.FileLock(os.path.join(lock_dir, "%s.lock" % it)) for it in lock_names
+        ]
+        waiting = False
+        while True:
+            for lock in locks:
+                try:
+                    lock.acquire(timeout=0)
+                    return lock
+                except filelock.Timeout:
+                    pass
+            if not waiting:
+                waiting = True
+                print("Waiting for one of %s launches on device %s to show up" % (len(locks), self.device))
+            time.sleep(0.05)
 
     def launch_app(
         self,
@@ -3553,34 +7033,60 @@ class ScrcpyWrapper:
         ime_preference: Optional[str] = None,
         # use_adb_keyboard=False,
         env={},
+        video_budget: Optional[Dict[str, Any]] = None,
+        on_spawned: Optional[List[Any]] = None,
+        profiler: Optional["LaunchProfiler"] = None,
     ):
+        """on_spawned: callables run in the background once scrcpy is started, not repeated on restart."""
         import signal
         import psutil
-        import json
         import sys
+        import time
 
-        previous_ime = self.get_previous_ime()
-        print("Previous IME:", previous_ime)
+        self.ime_preference = ime_preference
+
+        print("IME preference before launching app:", ime_preference)
+
+        def install_ime(cleanup):
+            # skipped when cleanup refuses the launch under keep_old
+            if ime_preference == "adbkeyboard":
+                self.swm.adb_wrapper.install_adb_keyboard()
+            elif ime_preference == "gboard":
+                self.swm.adb_wrapper.install_gboard()
+
+        def switch_ime(previous_ime, cleanup, ime_installed):
+            # after the previous ime is recorded and an old instance got its signal
+            if ime_preference == "adbkeyboard":
+                # if use_adb_keyboard:
+                self.swm.adb_wrapper.enable_and_set_adb_keyboard()
+            elif ime_preference == "gboard":
+                self.swm.adb_wrapper.enable_and_set_gboard()
 
-        # import time
         try:
-            self.cleanup_scrcpy_proc_pid_files(app_id=package_name)
+            results = run_task_graph(
+                {
+                    "previous_ime": ([], self.get_previous_ime),
+                    "cleanup": (
+                        [],
+                        lambda: self.cleanup_scrcpy_proc_pid_files(app_id=package_name),
+                    ),
+                    "ime_installed": (["cleanup"], install_ime),
+                    "ime_switched": (["previous_ime", "cleanup", "ime_installed"], switch_ime),
+                },
+                max_workers=self.config.get("launch_prepare_workers", 4),
+            )
         except OldInstanceRunning as e:
             print(e.args[0])
+            if profiler:
+                profiler.finish("old_instance_running")
             return
+        if profiler:
+            profiler.mark("ime_setup")
+        previous_ime = results["previous_ime"]
+        print("Previous IME:", previous_ime)
 
         args = []
 
-        self.ime_preference = ime_preference
-
-        print("IME preference before launching app:", ime_preference)
-
-        if ime_preference == "adbkeyboard":
-            # if use_adb_keyboard:
-            self.install_and_use_adb_keyboard()
-        elif ime_preference == "gboard":
-            self.install_and_use_gboard()
-
         configured_window_options = []
 
         zoom_factor = self.config.zoom_factor  # TODO: make use of it
@@ -3601,6 +7107,20 @@ class ScrcpyWrapper:
             if not check_flag_presense_in_custom_args(flag = "--no-audio", custom_args = scrcpy_args):
                 args.extend(["--no-audio"])
 
+        if video_budget:
+            # assigned by the governor, rates configured by the user win
+            bit_rate = video_budget.get("video_bit_rate_mbps")
+            budget_options = [
+                ("--max-fps", video_budget.get("max_fps")),
+                ("--video-bit-rate", "%sM" % bit_rate if bit_rate else None),
+                ("--max-size", video_budget.get("max_size")),
+            ]
+            for flag, value in budget_options:
+                if value is None:
+                    continue
+                if not check_flag_presense_in_custom_args(flag=flag, custom_args=scrcpy_args):
+                    args.append("%s=%s" % (flag, value))
+
         if title:
             if not check_flag_presense_in_custom_args(flag = "--window-title", custom_args = scrcpy_args):
                 args.extend(["--window-title", title])
@@ -3636,8 +7156,10 @@ class ScrcpyWrapper:
                 _env["SCRCPY_ICON_PATH"] = swm_icon_path
 
         print("Acquiring lock")
-        lock = self.acquire_app_launch_lock()
+        lock = self.acquire_app_launch_lock(new_display=new_display)
         print("Lock acquired")
+        if profiler:
+            profiler.mark("lock_wait")
 
         # merge stderr with stdout
         proc = subprocess.Popen(
@@ -3649,20 +7171,25 @@ class ScrcpyWrapper:
             env=_env,
         )
         setattr(proc, "app_id", package_name)
+        setattr(proc, "ime_preference", ime_preference)
+        setattr(proc, "started_at", time.time())
+        setattr(proc, "video_budget", video_budget)
+        setattr(proc, "launch_profiler", profiler)
+        if profiler:
+            profiler.mark("scrcpy_spawn")
         proc_pid = proc.pid
+        self.procs[proc_pid] = proc
 
         print("Scrcpy PID:", proc_pid)
 
         self.swm.ime_manager.run_previous_ime_restoration_script()  # BUG: no multicursor across multiple tab of the same file in vscode
 
-        self.start_sidecar_scrcpy_app_monitor_thread(package_name, proc)
-
-        self.start_sidecar_scrcpy_monitor_control_port(proc)
-
-        if new_display:
-            self.start_sidecar_scrcpy_stdout_monitor_thread(proc)
-        else:
+        scrcpy_logs = self.swm.scrcpy_logs
+        setattr(proc, "scrcpy_log", scrcpy_logs.open_window(proc_pid, self.device, package_name))
+        if not new_display:
             setattr(proc, "display_id", 0)
+        # drained in any case, a full stdout pipe would stall scrcpy
+        self.start_sidecar_scrcpy_stdout_monitor_thread(proc)
         assert proc.stderr
 
         if not previous_ime:
@@ -3681,52 +7208,60 @@ class ScrcpyWrapper:
             no_audio=no_audio,
             # use_adb_keyboard=use_adb_keyboard,
             ime_preference=ime_preference,
-        )
+        )  # video_budget stays out, a restored session starts at full rate
 
-        self.start_sidecar_ime_activator(proc=proc)
+        if self.ime_preference not in ["gboard", "adbkeyboard"]:
+            print(
+                "IME preference %s is not set to gboard or adbkeyboard"
+                % self.ime_preference
+            )
 
-        swm_scrcpy_proc_pid_path = self.generate_swm_scrcpy_proc_pid_path()
         # lock = None
 
-        self.start_sidecar_app_launch_filelock_releaser(proc=proc, lock=lock)
-        # write the pid to the path
-        with open(swm_scrcpy_proc_pid_path, "w") as f:
-            data = dict(
-                pid=proc_pid, device_id=self.device, launch_params=launch_params
-            )
-            content_data = json.dumps(data, indent=4, ensure_ascii=False)
-            f.write(content_data)
+        # app monitor, ime activator, control port and launch lock release all run in the device monitor
+        setattr(proc, "app_launch_lock", lock)
+        device_monitor = self.swm.get_device_monitor(self.device)
+        device_monitor.subscribe(proc, self.on_device_state)
+        record_id = self.swm.scrcpy_processes.register(
+            proc_pid, self.device, launch_params
+        )
 
         latest_session_name = "latest"
-        if self.is_device_connected():
-            if self.swm.config.session_autosave:
-                self.swm.session_manager.save(
-                    latest_session_name
-                )  # you may also save on exit?
+
+        def autosave_session():
+            if self.is_device_connected():
+                if self.swm.config.session_autosave:
+                    self.swm.session_manager.save(
+                        latest_session_name
+                    )  # you may also save on exit?
+
+        # not on the way to the window
+        for it in [autosave_session, *(on_spawned or [])]:
+            start_daemon_thread(it)
+        unicode_input = None
         try:
             if ime_preference == "adbkeyboard":
-                self.start_sidecar_unicode_input(
-                    proc=proc,
+                unicode_input = UnicodeInputPipeline(
+                    self.adb_wrapper,
+                    debounce=self.config.get("unicode_input_debounce", 0.015),
                 )
             for line in proc.stderr:
                 captured_line = line.strip()
+                # the user is doing something in this window
+                device_monitor.poke()
                 if self.config.verbose:
                     ...
-                print(
-                    "<scrcpy stderr> %s" % captured_line
-                )  # now we check if this indicates some characters we need to type in
+                # never blocks on terminal or file i/o
+                scrcpy_logs.put(proc_pid, "stderr", captured_line)
+                # now we check if this indicates some characters we need to type in
                 if "WARN: Device disconnected" in captured_line:
                     setattr(proc, "device_disconnected", True)
                     break
                 if captured_line.startswith(unicode_char_warning):
                     char_repr = captured_line[len(unicode_char_warning) :].strip()
                     char_str = convert_unicode_escape(char_repr)
-                    if char_str:
-                        pending_unicode_input = getattr(
-                            proc, "pending_unicode_input", ""
-                        )
-                        pending_unicode_input += char_str
-                        setattr(proc, "pending_unicode_input", pending_unicode_input)
+                    if char_str and unicode_input is not None:
+                        unicode_input.put(char_str)
                     # TODO: use clipboard set and paste instead
                     # TODO: make unicode_input_method a text based config, opening the main display to show the default input method interface when no clipboard input or adb keyboard is enabled
                     # TODO: hover the main display on the focused new window to show input candidates
@@ -3734,6 +7269,13 @@ class ScrcpyWrapper:
                 # [server] WARN: Could not inject char u+4f60
                 # TODO: use adb keyboard for pasting text from clipboard, if the scrcpy clipboard api fails (can we know this from verbose log, or do we need to change the code?)
         finally:
+            self.procs.pop(proc_pid, None)
+            scrcpy_logs.close_window(proc_pid)
+            if profiler:
+                # gone before the app showed up
+                profiler.finish("window_closed")
+            if unicode_input is not None:
+                unicode_input.close()
             if self.is_device_connected():
                 if self.swm.config.session_autosave:
                     self.swm.session_manager.save(latest_session_name)
@@ -3765,12 +7307,10 @@ class ScrcpyWrapper:
             if hasattr(proc, "terminate_reason"):
                 terminate_reason = getattr(proc, "terminate_reason")
             else:
-                # read the reason from pid file
-                if os.path.exists(swm_scrcpy_proc_pid_path):
-                    with open(swm_scrcpy_proc_pid_path, "r") as f:
-                        data = json.load(f)
-                        assert type(data) == dict
-                        terminate_reason = data.get("terminate_reason", "unknown")
+                # another swm process may have set the reason, e.g. new_instance
+                record = self.swm.scrcpy_processes.get(record_id)
+                if record:
+                    terminate_reason = record["terminate_reason"] or "unknown"
 
             # kill by pid, if alive
             if psutil.pid_exists(proc_pid):
@@ -3788,19 +7328,23 @@ class ScrcpyWrapper:
 
             terminate_success = False
             # time.sleep(0.5) # reduce false nagative of terminate_success
-            if os.path.exists(swm_scrcpy_proc_pid_path):
+            if self.swm.scrcpy_processes.get(record_id):
                 if not psutil.pid_exists(proc_pid):
                     terminate_success = True
-                    os.remove(swm_scrcpy_proc_pid_path)
+                    self.swm.scrcpy_processes.remove(record_id)
                 else:
                     print(
-                        "Not removing PID file %s since the scrcpy process %s is still running (termination might be pending)"
-                        % (swm_scrcpy_proc_pid_path, proc_pid)
+                        "Not removing registry record %s since the scrcpy process %s is still running (termination might be pending)"
+                        % (record_id, proc_pid)
                     )
 
             has_exception = ex_type is not None
 
             print("Has exception:", has_exception)
+            if not scrcpy_logs.echo and terminate_reason in ["unknown", "swm_error"]:
+                print("Last scrcpy output:")
+                for it in getattr(proc, "scrcpy_log").tail(20):
+                    print(it)
             print("Scrcpy terminate reason:", terminate_reason)
             print("Terminate success:", terminate_success)
 
@@ -3815,6 +7359,8 @@ class ScrcpyWrapper:
             app_stop_reasons = self.config.app_stop_reasons
 
             need_restart = not has_exception and (terminate_reason in restart_reasons)
+            if terminate_reason == "governor_reconfigure":
+                need_restart = not has_exception
 
             need_app_stop = self.is_device_connected() and (terminate_reason in app_stop_reasons)
 
@@ -3836,6 +7382,9 @@ class ScrcpyWrapper:
                     self.wait_for_device_reconnect()
                 restart_params = launch_params.copy()
                 restart_params["env"] = env
+                if terminate_reason == "governor_reconfigure":
+                    print("Relaunching with the video budget assigned by the governor")
+                    restart_params["video_budget"] = getattr(proc, "next_video_budget")
                 self.launch_app(**restart_params)
             
             elif need_app_stop:
@@ -3851,48 +7400,20 @@ class ScrcpyWrapper:
                     else:
                         print("Device offline, cannot revert to previous IME")
 
-    def start_sidecar_unicode_input(
-        self,
-        proc: subprocess.Popen,
-        # use_adb_keyboard: bool,
-        poll_interval=0.1,
-        pid_check_interval=1,
+    async def check_app_in_display(
+        self, app_id: str, display_id: int, max_age: Optional[float] = None
     ):
-        import time
-        import psutil
-
-        def unicode_input():
-            proc_pid = proc.pid
-            last_pid_check_reltime = 0
-            while True:
-                time.sleep(poll_interval)
-                last_pid_check_reltime += poll_interval
-                if last_pid_check_reltime >= pid_check_interval:
-                    last_pid_check_reltime = 0
-                    if not psutil.pid_exists(proc_pid):
-                        break
-                if getattr(proc, "terminate_reason", ""):
-                    break
-                pending_unicode_input = getattr(proc, "pending_unicode_input", "")
-                if not pending_unicode_input:
-                    continue
-                else:
-                    setattr(proc, "pending_unicode_input", "")
-                # if use_adb_keyboard:
-                # TODO: check if the adb keyboard is "really" activated (with the grey bar underneath the screen) programatically before broadcasting the intent
-                self.adb_wrapper.adb_keyboard_input_text(pending_unicode_input)
-                # else:
-                #     self.clipboard_paste_input_text(pending_unicode_input)
-
-        start_daemon_thread(unicode_input)
-
-    def check_app_in_display(self, app_id: str, display_id: int):
         assert self.device
-        device_online = self.is_device_connected()
+        async_adb_wrapper = self.swm.async_adb_wrapper
+        device_online = await async_adb_wrapper.check_device_online(self.device)
         if device_online:
-            app_is_foreground = self.adb_wrapper.check_app_is_foreground(app_id)
-            app_is_in_display = self.adb_wrapper.check_app_in_display(
-                app_id, display_id
+            # one sweep for both, max_age=0 would otherwise sweep twice
+            snapshot = await async_adb_wrapper.get_state_snapshot(max_age)
+            app_is_foreground = async_adb_wrapper.snapshot_app_is_foreground(
+                snapshot, app_id
+            )
+            app_is_in_display = async_adb_wrapper.snapshot_app_in_display(
+                snapshot, app_id, display_id
             )
         else:
             raise DeviceOfflineError(
@@ -3913,71 +7434,19 @@ class ScrcpyWrapper:
         def monitor_stdout_and_set_attribute():
             for line in proc_stdout:
                 line = line.strip()
-                print("<scrcpy stdout> %s" % line)
+                self.swm.scrcpy_logs.put(proc.pid, "stdout", line)
                 if line.startswith("[server] INFO: New display:"):
                     display_id = line.split("=")[-1].strip("()")
                     display_id = int(display_id)
                     setattr(proc, "display_id", display_id)
+                    profiler = getattr(proc, "launch_profiler", None)
+                    if profiler:
+                        profiler.mark("new_display")
+                    # the app lands in this display right now, check for it without waiting for the next pass
+                    self.swm.get_device_monitor(self.device).poke(force=True)
 
         start_daemon_thread(monitor_stdout_and_set_attribute)
 
-    def scrcpy_app_monitor(self, app_id: str, proc: subprocess.Popen):
-        # import signal
-        import time
-        import psutil
-
-        proc_pid = proc.pid
-        reconfirming_times = 3
-        reconfirming_interval = 0.2
-
-        while True:
-            time.sleep(0.2)
-            if hasattr(proc, "display_id"):
-                display_id = getattr(proc, "display_id")
-                break
-
-        last_app_in_display = (
-            app_in_display
-        ) = True  # self.check_app_in_display(app_id, display_id)
-        while True:
-            last_app_in_display = app_in_display
-            time.sleep(1)
-            try:
-                app_in_display = self.check_app_in_display(app_id, display_id)
-                setattr(proc, "app_in_display", app_in_display)
-            except DeviceOfflineError as e:
-                print(e.args[0])
-                break
-            process_alive = psutil.pid_exists(proc_pid)
-            if not process_alive:
-                break
-            if (
-                last_app_in_display == True and app_in_display == False
-            ):  # app terminated
-                # before terminate, analyze the current dump
-                # TODO: restart app in given display, using adb shell
-                for trial in range(reconfirming_times):
-                    time.sleep(reconfirming_interval)
-                    print(
-                        "App %s seems not in display %s. Reconfirming %s/%s"
-                        % (app_id, display_id, trial + 1, reconfirming_times)
-                    )
-                    if self.check_app_in_display(app_id, display_id):
-                        app_in_display = True
-                        break
-                if app_in_display:
-                    continue
-                active_apps = self.adb_wrapper.get_active_apps()
-                display_current_focus = self.adb_wrapper.get_display_current_focus()
-                print("Dump info before killing scrcpy:")
-                print("Active apps:", active_apps)
-                print("Display current focus:", display_current_focus)
-                proc.terminate()
-                if not hasattr(proc, "terminate_reason"):
-                    setattr(proc, "terminate_reason", "app_gone")
-                # os.kill(proc_pid, signal.SIGKILL)
-                break
-
     def get_previous_ime(self):
         adbkeyboard_ime = "com.android.adbkeyboard/.AdbIME"
         previous_ime = self.adb_wrapper.get_current_ime()
@@ -4002,51 +7471,17 @@ class ScrcpyWrapper:
         # assert self.swm.on_device_db
         # self.swm.on_device_db.write_previous_ime(previous_ime)
 
-    def start_sidecar_scrcpy_app_monitor_thread(
-        self, app_id: str, proc: subprocess.Popen
-    ):
-        # configure this thread with daemon=True
-        start_daemon_thread(
-            target=self.scrcpy_app_monitor, kwargs=dict(app_id=app_id, proc=proc)
-        )
-
-    def generate_swm_scrcpy_proc_pid_path(self):
-        import uuid
-
-        unique_id = str(uuid.uuid4())
-        filename = "%s.json" % unique_id
-        ret = os.path.join(self.swm_scrcpy_proc_pid_basedir, filename)
-        return ret
-
-    @property
-    def swm_scrcpy_proc_pid_basedir(self):
-        ret = os.path.join(self.config.cache_dir, "swm_scrcpy_proc_pid")
-        if not os.path.exists(ret):
-            os.makedirs(ret, exist_ok=True)
-        return ret
-
     @property
     def has_swm_process_running(self):
         return len(self.get_running_swm_managed_scrcpy_pids()) > 0
 
-    def list_swm_managed_scrcpy_pid_files(self):
-        ret = []
-        for it in os.listdir(self.swm_scrcpy_proc_pid_basedir):
-            path = os.path.join(self.swm_scrcpy_proc_pid_basedir, it)
-            if os.path.isfile(path):
-                if not path.endswith(".json"):
-                    continue
-                ret.append(path)
-        return ret
-
     def get_running_swm_managed_scrcpy_pids(self):
         ret = self.get_running_swm_managed_scrcpy_info_list()
         ret = [it["pid"] for it in ret]
         return ret
 
     def check_app_running(self, app_id: str):
-        running_app_ids = self.get_running_app_ids()
-        ret = app_id in running_app_ids
+        ret = len(self.get_running_swm_managed_scrcpy_info_list(app_id=app_id)) > 0
         return ret
 
     def get_running_app_ids(self):
@@ -4061,65 +7496,61 @@ class ScrcpyWrapper:
         )
 
     def get_running_swm_managed_scrcpy_info_list(
-        self, remove_inactive=False, remove_app_id: Optional[str] = None, drop_pid=False
+        self,
+        remove_inactive=False,
+        remove_app_id: Optional[str] = None,
+        drop_pid=False,
+        app_id: Optional[str] = None,
     ):
-        import psutil
-        import json
         import signal
 
         ret = []
         assert self.device
-        for path in self.list_swm_managed_scrcpy_pid_files():
-            if not os.path.exists(path):
-                print("PID file %s is gone. Skipping" % path)
-                continue
-            with open(path, "r") as f:
-                data = json.load(f)
-            assert type(data) == dict
-            terminate_reason = data.get("terminate_reason", None)
+        registry = self.swm.scrcpy_processes
+        if remove_app_id:
+            app_id = remove_app_id
+        for record in registry.list_windows(self.device, app_id=app_id):
+            record_id = record.pop("record_id")
+            record.pop("app_id")
+            create_time = record.pop("create_time")
+            terminate_reason = record.get("terminate_reason", None)
             if terminate_reason:
-                os.remove(path)
-            pid = data["pid"]
-            pid = int(pid)
-            if psutil.pid_exists(pid):
-                app_id = data["launch_params"]["package_name"]
-                device_id = data["device_id"]
-                if device_id != self.device:
-                    continue
-                else:
-                    if remove_app_id and app_id == remove_app_id:
-                        launch_policy = self.swm.config.launch_policy
-                        if launch_policy == "keep_new":
-                            print(
-                                "Terminating old scrcpy process (PID: %s) for app_id:"
-                                % pid,
-                                app_id,
-                            )
-                            os.kill(pid, signal.SIGTERM)
-                            # now write the file
-                            data["terminate_reason"] = "new_instance"
-                            with open(path, "w") as f:
-                                json.dump(data, f)
-                            continue
-                        elif launch_policy == "keep_old":
-                            # kill current process right now
-                            raise OldInstanceRunning(
-                                "An app instance %s for device %s is running, and your launch_policy is %s"
-                                % (app_id, self.device, launch_policy)
-                            )
-                        else:
-                            # TODO: use pydantic to load config
-                            print(
-                                "Ineffective launch policy %s, ignoring" % launch_policy
-                            )
+                registry.remove(record_id)
+            pid = record["pid"]
+            if registry.is_alive(dict(pid=pid, create_time=create_time)):
+                app_id = record["launch_params"]["package_name"]
+                if remove_app_id and app_id == remove_app_id:
+                    launch_policy = self.swm.config.launch_policy
+                    if launch_policy == "keep_new":
+                        print(
+                            "Terminating old scrcpy process (PID: %s) for app_id:"
+                            % pid,
+                            app_id,
+                        )
+                        # the old window reads the reason once its scrcpy is gone
+                        registry.set_terminate_reason(record_id, "new_instance")
+                        os.kill(pid, signal.SIGTERM)
+                        continue
+                    elif launch_policy == "keep_old":
+                        # kill current process right now
+                        raise OldInstanceRunning(
+                            "An app instance %s for device %s is running, and your launch_policy is %s"
+                            % (app_id, self.device, launch_policy)
+                        )
+                    else:
+                        # TODO: use pydantic to load config
+                        print(
+                            "Ineffective launch policy %s, ignoring" % launch_policy
+                        )
                 if drop_pid:
-                    if "pid" in data:
-                        del data["pid"]
-                ret.append(data)
+                    del record["pid"]
+                if not record["terminate_reason"]:
+                    del record["terminate_reason"]
+                ret.append(record)
             else:
                 if remove_inactive:
-                    print("Removing inactive scrcpy pid file:", path)
-                    os.remove(path)
+                    print("Removing inactive scrcpy record:", record_id)
+                    registry.remove(record_id)
         return ret
 
     def clipboard_paste_input_text(self, text: str):
@@ -4204,7 +7635,12 @@ class ImeManager:
             "busybox nohup sh %s & exit 0" % self.ime_restorator_installation_path,
         ]
         # TODO: make it truly background without threading, or handle its exception at device disconnection
-        start_daemon_thread(target=self.swm.adb_wrapper.execute_shell, args=(cmd,))
+        # backgrounded job keeps the output pipe open, never run it in the persistent shell
+        start_daemon_thread(
+            target=self.swm.adb_wrapper.execute_shell,
+            args=(cmd,),
+            kwargs=dict(transport="subprocess", call_class="interactive"),
+        )
 
     def install_previous_ime_restoration_script(self):
         # just write the content to the path, if sha256 mismatch or file missing
@@ -4288,6 +7724,44 @@ exit 0
         ret = self.swm.adb_wrapper.get_current_ime()
         return ret
 
+    def benchmark(self, count: int = 40, burst: int = 4, typing_interval: float = 0.2):
+        """Keystroke to device latency of adb keyboard input, one adb process per flush vs the input pipeline."""
+        import time
+
+        adb_wrapper = self.swm.adb_wrapper
+        adbkeyboard_ime = "com.android.adbkeyboard/.AdbIME"
+        if adb_wrapper.get_current_ime() != adbkeyboard_ime:
+            print("Warning: current IME is not %s, nothing will be typed" % adbkeyboard_ime)
+        print("Typing %s chars twice into the focused input field" % count)
+        text = ("你好世界" * count)[:count]
+        bursts = [text[i : i + burst] for i in range(0, count, burst)]
+
+        # what the polling sidecar did per flush, not counting its 100 ms poll
+        subprocess_latencies = []
+        for chars in bursts:
+            queued_at = time.monotonic()
+            adb_wrapper.adb_keyboard_input_text(chars, transport="subprocess")
+            subprocess_latencies.extend([time.monotonic() - queued_at] * len(chars))
+            time.sleep(typing_interval)
+
+        # scrcpy reports an IME commit as one stderr line per char
+        pipeline = UnicodeInputPipeline(
+            adb_wrapper, debounce=self.swm.config.get("unicode_input_debounce", 0.015)
+        )
+        for chars in bursts:
+            for it in chars:
+                pipeline.put(it)
+            time.sleep(typing_interval)
+        pipeline.close(wait=True)
+
+        load_and_print_as_dataframe(
+            [
+                {"path": "subprocess per flush", **summarize_durations_ms(subprocess_latencies)},
+                {"path": "input pipeline", **summarize_durations_ms(pipeline.latencies)},
+            ],
+            sort_columns=False,
+        )
+
     def list(self, display=False):
         sort_order = {"active": 1, "installed": 2, "selected": 0}
         ret = self.swm.adb_wrapper.list_installed_imes()
@@ -4619,6 +8093,59 @@ def create_default_config(cache_dir: str):
                 "https://kgithub.com",
             ],
             "launch_policy": "keep_new",  # keep_new, keep_old
+            "app_launch_grace": 15,  # seconds a new window may wait for its app before it counts as gone
+            "launch_lock_scope": "device",  # global, device, display
+            "launch_concurrency": 2,  # launches per device waiting for their app to show up at once
+            "launch_prepare_workers": 4,  # independent steps before scrcpy starts run in parallel
+            "launch_log_path": os.path.join(cache_dir, "launch_log.jsonl"),  # phases of every app run, see "app timings"
+            "scrcpy_registry_path": os.path.join(cache_dir, "scrcpy_processes.db"),  # running scrcpy windows of every swm process
+            "scrcpy_governor": {  # fps and bit rate budget per device, background windows get relaunched at low rates
+                "enabled": False,  # opt in, it kills and relaunches windows on its own
+                "encoder_fps_budget": 180,  # frames per second the device encoder sustains over all windows
+                "bit_rate_budget_mbps": 32,  # usb or wifi bandwidth for all windows of a device
+                "focused_max_fps": 60,
+                "focused_bit_rate_mbps": 8,
+                "min_fps": 1,
+                "background_max_size": 1024,
+                "promote_after": 1,  # seconds a window must stay focused before it gets full rate
+                "demote_after": 15,  # seconds a window must stay in background before it is slowed down
+                "min_lifetime": 10,  # seconds after a launch before a window may be relaunched
+            },
+            "scrcpy_log": {  # scrcpy output of every window, see "swm logs"
+                "dir": os.path.join(cache_dir, "scrcpy_logs"),
+                "echo": True,  # also print it to the terminal
+                "ring_size": 500,  # recent lines kept in memory per window
+                "max_bytes": 1024 * 1024,  # rotate a window log at this size
+                "backup_count": 3,
+                "queue_size": 10000,  # lines waiting for the writer, more are dropped instead of blocking scrcpy
+                "repeat_interval": 5,  # seconds a repeated line (e.g. --print-fps) stays folded into a count
+                "keep_windows": 50,  # logs of older windows are removed when a window opens
+            },
+            "daemon_socket_path": os.path.join(cache_dir, "swmd.sock"),  # "app run" goes through swmd while it listens here
+            "daemon_log_path": os.path.join(cache_dir, "swmd.log"),
+            "adb_transport": "subprocess",  # subprocess, shell_session, socket
+            "adb_server_host": "127.0.0.1",
+            "adb_server_port": 5037,  # ANDROID_ADB_SERVER_PORT takes precedence
+            "adb_file_transfer": "subprocess",  # subprocess, sync
+            "adb_max_concurrency_per_device": 4,  # for coroutine based monitors
+            "adb_track_devices": True,  # keep device presence in memory from "adb track-devices"
+            "adb_root_shell": True,  # keep one su shell per device open for root commands
+            "device_fan_out_max_workers": 4,  # devices served at once by --device all
+            "device_state_snapshot_ttl": 0.5,  # seconds a device state sweep is shared by monitors
+            "device_monitor_interval": 0.5,  # seconds between passes right after a launch or change
+            "device_monitor_max_interval": 5,  # backoff ceiling while nothing changes
+            "device_monitor_backoff": 2,  # interval multiplier per unchanged pass
+            "device_event_stream": True,  # wake the device monitor from logcat events instead of polling
+            "device_monitor_event_interval": 30,  # backoff ceiling while the event stream is up
+            "unicode_input_debounce": 0.015,  # seconds to coalesce chars of one IME commit into a broadcast
+            "subprocess_timeouts": {  # seconds, null for no deadline
+                "query": 20,
+                "mutation": 60,
+                "transfer": 600,
+                "interactive": None,
+            },
+            "subprocess_query_retries": 2,
+            "subprocess_retry_backoff": 0.5,  # seconds, doubled per retry with full jitter
             "restart_reasons": [
                 "device_offline",
                 "app_gone",
@@ -4786,8 +8313,22 @@ def main():
         print(
             "Warning: Initialization incomplete. Consider running 'swm init' to download missing binaries."
         )
+    tracer = None
+    trace_file = args["--trace"]
+    if trace_file:
+        import atexit
+
+        tracer = AdbCallTracer(record_events=True)
+        atexit.register(tracer.save_and_print_summary, trace_file)
+
     # Initialize SWM core
-    swm = SWM(config)
+    swm = SWM(config, tracer=tracer)
+    daemon_socket_path = config.get(
+        "daemon_socket_path", os.path.join(SWM_CACHE_DIR, "swmd.sock")
+    )
+    daemon_log_path = config.get(
+        "daemon_log_path", os.path.join(SWM_CACHE_DIR, "swmd.log")
+    )
 
     # # Command routing
     # try:
@@ -4822,6 +8363,8 @@ def main():
         if args["list"]:
             last_used = args["last-used"]
             swm.device_manager.list(print_formatted=True, show_last_used=last_used)
+        elif args["status"] and args["--device"] == ALL_DEVICES:
+            swm.device_fan_out.status()
         elif args["status"]:
             # raise NotImplementedError("Device status is not implemented yet")
             query = args["<query>"]
@@ -4844,8 +8387,86 @@ def main():
         elif args["name"]:
             swm.device_manager.name(args["<device_id>"], args["<device_alias>"])
 
+    elif args["daemon"]:
+        daemon_client = SwmDaemonClient(daemon_socket_path)
+        if (args["serve"] or args["start"]) and not daemon_client.is_supported():
+            raise SwmDaemonError("swmd needs unix sockets, which this platform lacks")
+        if args["serve"]:
+            SwmDaemon(swm, daemon_socket_path).serve_forever()
+        elif args["start"]:
+            if daemon_client.is_running():
+                print("swmd is already running")
+                return
+            import time
+
+            cmd = [sys.executable, "-m", "swm.cli", "daemon", "serve"]
+            if args["--config"]:
+                cmd.extend(["--config", args["--config"]])
+            with open(daemon_log_path, "a") as log_file:
+                spawn_and_detach_process(
+                    cmd, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL
+                )
+            for _ in range(100):
+                if daemon_client.is_running():
+                    print("swmd started, logging to %s" % daemon_log_path)
+                    break
+                time.sleep(0.1)
+            else:
+                raise SwmDaemonError(
+                    "swmd did not come up, see %s" % daemon_log_path
+                )
+        elif not daemon_client.is_running():
+            print("swmd is not running")
+        elif args["stop"]:
+            result = daemon_client.request("shutdown")
+            print("swmd (PID: %s) is stopping" % result["pid"])
+        elif args["status"]:
+            print(pretty_print_json(daemon_client.request("status")))
+
+    elif args["window"]:
+        daemon_client = SwmDaemonClient(daemon_socket_path)
+        if not daemon_client.is_running():
+            raise SwmDaemonError("swmd is not running, start it with 'swm daemon start'")
+        if args["list"]:
+            load_and_print_as_dataframe(daemon_client.request("list"), sort_columns=False)
+        elif args["stop"]:
+            load_and_print_as_dataframe(
+                daemon_client.request("stop", query=args["<query>"]), sort_columns=False
+            )
+        elif args["restart"]:
+            load_and_print_as_dataframe(
+                daemon_client.request("restart", query=args["<query>"]),
+                sort_columns=False,
+            )
+
+    elif args["logs"]:
+        # the newest window log of a scrcpy pid or app id, no device needed
+        log_path = find_scrcpy_log_file(swm.scrcpy_logs.log_dir, args["<query>"])
+        try:
+            tail_scrcpy_log(log_path, follow=args["follow"])
+        except KeyboardInterrupt:
+            pass
+
+    elif args["app"] and args["timings"]:
+        # read from the launch log, no device needed
+        load_and_print_as_dataframe(
+            summarize_launch_log(swm.launch_log_path), sort_columns=False
+        )
+
     elif args["--version"]:
         print(f"SWM version {__version__}")
+    elif args["--device"] == ALL_DEVICES:
+        if args["app"] and args["list"] and args["update"]:
+            swm.device_fan_out.update_app_list()
+        elif args["session"] and args["save"]:
+            swm.device_fan_out.save_session(args["<session_name>"])
+        elif args["ime"] and args["switch"]:
+            swm.device_fan_out.switch_ime(args["<query>"])
+        else:
+            raise ValueError(
+                "This command does not support --device %s, use a device ID or name"
+                % ALL_DEVICES
+            )
     else:
         # Device specific branches
 
@@ -4915,12 +8536,35 @@ def main():
                 no_new_display = args["no-new-display"]
                 query = args["<query>"]
                 init_config = args["<init_config>"]
-                app_id = swm.app_manager.resolve_app_query(query)
-                swm.app_manager.run(
-                    app_id,  # type: ignore
-                    init_config=init_config,
-                    new_display=not no_new_display,
+                profiler = swm.create_launch_profiler(
+                    query, print_on_finish=args["--timings"]
                 )
+                app_id = swm.app_manager.resolve_app_query(query)
+                profiler.app_id = app_id
+                profiler.mark("query_resolve")
+                daemon_client = SwmDaemonClient(daemon_socket_path)
+                # timings are printed by the process that launches the app
+                if not args["--timings"] and daemon_client.is_running():
+                    # swmd supervises the window, this process is done
+                    daemon_client.request(
+                        "run",
+                        device_id=swm.current_device,
+                        app_id=app_id,
+                        init_config=init_config,
+                        new_display=not no_new_display,
+                    )
+                    print("App %s launched by swmd, see 'swm window list'" % app_id)
+                else:
+                    try:
+                        swm.app_manager.run(
+                            app_id,  # type: ignore
+                            init_config=init_config,
+                            new_display=not no_new_display,
+                            profiler=profiler,
+                        )
+                    except Exception:
+                        profiler.finish("failed")
+                        raise
 
             elif args["config"]:
                 config_name = args["<config_name>"]
@@ -4977,6 +8621,12 @@ def main():
                     swm.ime_manager.switch(ime_id)
             elif args["switch-to-previous"]:
                 swm.ime_manager.switch_to_previous()
+            elif args["benchmark"]:
+                count = args["<count>"]
+                if count is None:
+                    swm.ime_manager.benchmark()
+                else:
+                    swm.ime_manager.benchmark(count=int(count))
             else:
                 ...
         elif args["java"]:
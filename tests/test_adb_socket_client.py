@@ -0,0 +1,112 @@
+import socketserver
+import struct
+import subprocess
+import threading
+
+import pytest
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("tinydb")
+
+from swm.cli import AdbSocketClient
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    # speaks the host side of the adb server protocol, "device" commands run in the local sh
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, features):
+        super().__init__(("127.0.0.1", 0), FakeAdbHandler)
+        self.features = features
+        self.requests = []
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def read_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def reply(self, payload: bytes):
+        self.request.sendall(b"OKAY" + b"%04x" % len(payload) + payload)
+
+    def run(self, cmd):
+        return subprocess.run(["sh", "-c", cmd], capture_output=True)
+
+    def handle(self):
+        while True:
+            try:
+                length = int(self.read_exact(4), 16)
+            except EOFError:
+                return
+            request = self.read_exact(length).decode()
+            self.server.requests.append(request)
+            if request == "host:devices":
+                self.reply(b"emulator-5554\tdevice\n")
+                return
+            if request.endswith(":features"):
+                self.reply(",".join(self.server.features).encode())
+                return
+            if request.startswith("host:transport:"):
+                self.request.sendall(b"OKAY")
+                continue
+            if request.startswith("shell,v2,raw:"):
+                self.request.sendall(b"OKAY")
+                result = self.run(request[len("shell,v2,raw:") :])
+                for packet_id, data in [(1, result.stdout), (2, result.stderr)]:
+                    if data:
+                        self.request.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+                self.request.sendall(struct.pack("<BI", 3, 1) + bytes([result.returncode]))
+                return
+            if request.startswith("shell:"):
+                # no exit code on the legacy protocol, stderr ends up in stdout
+                self.request.sendall(b"OKAY")
+                result = self.run(request[len("shell:") :] + " 2>&1")
+                self.request.sendall(result.stdout)
+                return
+            message = b"unknown service"
+            self.request.sendall(b"FAIL" + b"%04x" % len(message) + message)
+            return
+
+
+@pytest.fixture(params=[["shell_v2", "cmd"], ["cmd"]], ids=["shell_v2", "legacy"])
+def client(request):
+    server = FakeAdbServer(request.param)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield AdbSocketClient(port=server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_devices(client):
+    assert client.devices() == [{"id": "emulator-5554", "status": "device"}]
+
+
+def test_shell_stdout(client):
+    returncode, stdout, _ = client.shell("emulator-5554", "echo hello")
+    assert returncode == 0
+    assert stdout == b"hello\n"
+
+
+def test_shell_exit_code(client):
+    returncode, stdout, _ = client.shell("emulator-5554", "echo partial; exit 3")
+    assert returncode == 3
+    assert stdout == b"partial\n"
+
+
+def test_shell_v2_keeps_stderr_apart():
+    server = FakeAdbServer(["shell_v2"])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = AdbSocketClient(port=server.server_address[1])
+        returncode, stdout, stderr = client.shell("emulator-5554", "echo out; echo err >&2")
+        assert (returncode, stdout, stderr) == (0, b"out\n", b"err\n")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("tinydb")
+
+from swm.cli import AppManager, NoAppError
+
+
+class FakeStateSnapshot:
+    def cached(self, max_age=None, device_id=None):
+        return None
+
+
+class FakeAdbWrapper:
+    device = "emulator-5554"
+
+    def __init__(self, installed_apps):
+        self.installed_apps = installed_apps
+        self.files = {}
+        self.state_snapshot = FakeStateSnapshot()
+
+    def get_app_apk_path(self, app_id):
+        if app_id in self.installed_apps:
+            return "/data/app/%s/base.apk" % app_id
+
+    def get_device_name(self, device_id):
+        return "emulator"
+
+    def get_display_and_lock_state(self):
+        return "on_unlocked"
+
+    def install_aapt_binary(self):
+        return True
+
+    def _get_app_name(self, apk_path):
+        return "App"
+
+    def test_path_existance(self, path):
+        return path in self.files
+
+    def write_file(self, path, content):
+        self.files[path] = content
+
+
+class FakeSWM:
+    def __init__(self, adb_wrapper):
+        self.adb_wrapper = adb_wrapper
+        self.config = {"launch_prepare_workers": 4}
+        self.current_device = adb_wrapper.device
+        self.app_config_dir = "/sdcard/.swm/apps"
+
+
+def test_run_missing_app_writes_no_config():
+    adb_wrapper = FakeAdbWrapper(installed_apps=[])
+    app_manager = AppManager(FakeSWM(adb_wrapper))
+    app_manager.get_app_config_path = lambda app_name: "/sdcard/.swm/apps/%s.yaml" % app_name
+    with pytest.raises(NoAppError):
+        app_manager.run("com.example.missing")
+    assert adb_wrapper.files == {}
@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("tinydb")
+
+from swm.cli import build_shell_batch, classify_adb_call
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["devices"],
+        ["shell", "dumpsys", "window"],
+        ["shell", "getprop", "ro.product.model"],
+        ["shell", "pm", "path", "com.example.app"],
+        ["shell", "settings get secure default_input_method"],
+        ["shell", "test", "-e", "/sdcard/.swm"],
+    ],
+)
+def test_queries(args):
+    assert classify_adb_call(args) == "query"
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["shell", "cat a > b"],
+        ["shell", "ls", ">", "f"],
+        ["shell", "cat a >> b"],
+        ["shell", "test -e x && rm x"],
+        ["shell", "ls; rm x"],
+        ["shell", "cat a | sh"],
+        ["shell", "dumpsys window | grep mCurrentFocus"],
+        ["shell", "am", "start", "-n", "com.example.app/.Main"],
+        ["shell", "su", "-c", "id"],
+    ],
+)
+def test_mutations(args):
+    assert classify_adb_call(args) == "mutation"
+
+
+@pytest.mark.parametrize(
+    "args,call_class",
+    [
+        ([], "interactive"),
+        (["shell"], "interactive"),
+        (["shell", "-t", "top"], "interactive"),
+        (["logcat"], "interactive"),
+        (["push", "a", "/sdcard/a"], "transfer"),
+        (["install", "app.apk"], "transfer"),
+    ],
+)
+def test_other_call_classes(args, call_class):
+    assert classify_adb_call(args) == call_class
+
+
+def test_batch_call_class():
+    assert build_shell_batch(["getprop", "dumpsys power"])[2] == "query"
+    assert build_shell_batch(["getprop", "cat a > b"])[2] == "mutation"
+    commands = ["dumpsys power | grep mHolding"]
+    assert build_shell_batch(commands)[2] == "mutation"
+    assert build_shell_batch(commands, call_class="query")[2] == "query"